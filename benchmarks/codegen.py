@@ -0,0 +1,43 @@
+"""Routing throughput of the interpreted search, versus the generated one.
+
+    python benchmarks/codegen.py
+
+"""
+
+import time
+
+from webstar import Router
+
+
+def build(num_routes):
+    router = Router()
+    for i in xrange(num_routes):
+        router.register('/page%d' % i, 'page %d' % i, kind='page')
+        router.register('/item%d/{id:int}' % i, 'item %d' % i, defaults=dict(format='html'))
+    router.register('/{name}', 'named')
+    return router
+
+
+def measure(router, paths, duration=1.0):
+    count = 0
+    start = time.time()
+    while time.time() - start < duration:
+        for path in paths:
+            router.route(path)
+        count += len(paths)
+    return count / (time.time() - start)
+
+
+def main():
+    for num_routes in (10, 50, 200):
+        router = build(num_routes)
+        paths = ['/page%d' % (num_routes - 1), '/item%d/123' % (num_routes // 2), '/other']
+        interpreted = measure(router, paths)
+        router.compile()
+        compiled = measure(router, paths)
+        print '%4d routes: interpreted %8.0f routes/s, compiled %8.0f routes/s (%.1fx)' % (
+            2 * num_routes + 1, interpreted, compiled, compiled / interpreted)
+
+
+if __name__ == '__main__':
+    main()
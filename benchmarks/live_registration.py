@@ -0,0 +1,81 @@
+"""Routing latency with and without bursts of concurrent registration.
+
+    python benchmarks/live_registration.py
+
+Three runs, each timing every `route` call of a reading thread:
+
+    idle -- No other thread.
+    control -- A writer thread registering the same bursts on a router of its
+        own, which the reader never sees; it costs the reader the same CPU
+        (and interpreter lock) as the live run, but none of the registration.
+    live -- The writer registering on the router being read.
+
+So the difference between the control and live runs is the cost to readers of
+the registrations themselves, rather than of sharing the machine.
+
+"""
+
+import threading
+import time
+
+from webstar import Router
+
+
+def build(num_routes):
+    router = Router()
+    for i in xrange(num_routes):
+        router.register('/page%d/{id:int}' % i, 'leaf %d' % i)
+    return router
+
+
+def measure(router, paths, duration, target):
+    stop = threading.Event()
+    registered = [0]
+    def writer():
+        i = 0
+        while not stop.is_set():
+            for j in xrange(50):
+                target.register('/burst%d' % i, 'burst')
+                i += 1
+            registered[0] = i
+            time.sleep(0.01)
+    if target is not None:
+        thread = threading.Thread(target=writer)
+        thread.start()
+    timer = time.time
+    latencies = []
+    start = timer()
+    try:
+        while timer() - start < duration:
+            for path in paths:
+                before = timer()
+                router.route(path)
+                latencies.append(timer() - before)
+    finally:
+        stop.set()
+        if target is not None:
+            thread.join()
+    latencies.sort()
+    return latencies, registered[0]
+
+
+def percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def main():
+    paths = ['/page%d/123' % i for i in (0, 10, 50, 99)]
+    percents = (50, 90, 99, 99.9)
+    print '%-8s %9s %s  %s' % ('run', 'routes', ' '.join('%8s' % ('p%s' % x) for x in percents),
+        'registrations')
+    for name in ('idle', 'control', 'live'):
+        router = build(100)
+        target = dict(idle=None, control=build(100), live=router)[name]
+        latencies, registered = measure(router, paths, 2.0, target)
+        print '%-8s %9d %s  %d' % (name, len(latencies),
+            ' '.join('%6.1fus' % (percentile(latencies, x) * 1e6) for x in percents),
+            registered)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Per-request overhead of RouteMetrics.
+
+    python benchmarks/metrics_overhead.py
+
+"""
+
+import time
+
+from webstar import Router
+from webstar import core
+from webstar.metrics import RouteMetrics
+
+
+def leaf(environ, start):
+    start('200 OK', [])
+    return ['leaf']
+
+
+def build():
+    root = Router()
+    blog = root.register('/blog', Router())
+    blog.register('/archive/{year:int}/{month:int}', leaf)
+    blog.register('/{slug:slug}', leaf)
+    return root
+
+
+def run(app, count):
+    def start(status, headers):
+        pass
+    begin = time.time()
+    for i in xrange(count):
+        environ = {'PATH_INFO': '/blog/archive/2012/10', 'SCRIPT_NAME': ''}
+        response = app(environ, start)
+        list(response)
+        close = getattr(response, 'close', None)
+        if close is not None:
+            close()
+    return (time.time() - begin) / count
+
+
+class FixedRouter(object):
+    
+    """Returns the same route for every request, without routing; so the time
+    left is that of the middleware alone."""
+    
+    def __init__(self, root, path):
+        self.root = root
+        self.route = root.route(path)
+        self.app = self.route.app
+        self.graph_generation = root.graph_generation
+    
+    def generate_children(self):
+        return self.root.generate_children()
+    
+    def wsgi_route(self, environ):
+        environ[core.HISTORY_ENVIRON_KEY] = self.route
+        return self.app
+    
+    def __call__(self, environ, start):
+        return self.wsgi_route(environ)(environ, start)
+
+
+def compare(apps, count):
+    # Interleaved, and in a rotating order, so that each sees the same load on
+    # the machine and none is always run straight after another.
+    times = dict((name, []) for name, app in apps)
+    for i in xrange(15):
+        i %= len(apps)
+        for name, app in apps[i:] + apps[:i]:
+            times[name].append(run(app, count))
+    return dict((name, min(values)) for name, values in times.iteritems())
+
+
+def main():
+    count = 5000
+    root = build()
+    
+    times = compare([('bare', root), ('metrics', RouteMetrics(root))], count)
+    print 'routed:'
+    print '    bare:     %.2fus per request' % (times['bare'] * 1e6)
+    print '    metrics:  %.2fus per request' % (times['metrics'] * 1e6)
+    print '    overhead: %.2fus per request' % ((times['metrics'] - times['bare']) * 1e6)
+    
+    fixed = FixedRouter(root, '/blog/archive/2012/10')
+    times = compare([('bare', fixed), ('metrics', RouteMetrics(fixed))], count * 10)
+    print 'middleware alone (a fixed route):'
+    print '    overhead: %.2fus per request' % ((times['metrics'] - times['bare']) * 1e6)
+
+
+if __name__ == '__main__':
+    main()
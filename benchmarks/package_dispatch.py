@@ -0,0 +1,43 @@
+"""Routing throughput to the last module of a package-shaped router, with and
+without dispatching on the leading segment.
+
+    python benchmarks/package_dispatch.py
+
+"""
+
+import time
+
+from webstar import Router
+
+
+def build(num_modules, dispatch):
+    router = Router()
+    if not dispatch:
+        router.dispatch_threshold = float('inf')
+    for i in xrange(num_modules):
+        module = router.register('/{package:module%d}' % i, Router())
+        module.register('/{id:int}', 'view %d' % i)
+    return router
+
+
+def measure(router, paths, duration=1.0):
+    count = 0
+    start = time.time()
+    while time.time() - start < duration:
+        for path in paths:
+            router.route(path)
+        count += len(paths)
+    return count / (time.time() - start)
+
+
+def main():
+    for num_modules in (10, 100, 500):
+        paths = ['/module%d/123' % (num_modules - 1), '/module%d/123' % (num_modules // 2)]
+        linear = measure(build(num_modules, False), paths)
+        dispatched = measure(build(num_modules, True), paths)
+        print '%4d modules: linear %8.0f routes/s, dispatched %8.0f routes/s' % (
+            num_modules, linear, dispatched)
+
+
+if __name__ == '__main__':
+    main()
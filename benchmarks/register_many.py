@@ -0,0 +1,38 @@
+"""Building a large router one registration at a time, versus in a batch.
+
+    python benchmarks/register_many.py
+
+"""
+
+import time
+
+from webstar import Router
+from webstar.pattern import Pattern
+
+
+def one_at_a_time(routes):
+    router = Router()
+    for pattern, app in routes:
+        router.register(pattern, app)
+    return router
+
+
+def batched(routes):
+    router = Router()
+    router.register_many(routes)
+    return router
+
+
+def main():
+    for num_routes in (1000, 5000, 20000):
+        routes = [('/page%d/{id:int}' % i, 'leaf %d' % i) for i in xrange(num_routes)]
+        for func in (one_at_a_time, batched):
+            # Patterns are compiled once per template; make both pay for it.
+            Pattern.clear_compile_cache()
+            start = time.time()
+            func(routes)
+            print '%-14s %6d routes: %.3fs' % (func.__name__, num_routes, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
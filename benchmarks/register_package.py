@@ -0,0 +1,94 @@
+"""Time and memory to register a large package tree, with and without
+compiled pattern interning.
+
+    python benchmarks/register_package.py [num_modules]
+
+"""
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+MODULE_SOURCE = '''
+from webstar import route
+
+@route('/')
+def index(environ, start): pass
+
+@route('/edit')
+def edit(environ, start): pass
+
+@route('/{id:\\d+}')
+def view(environ, start): pass
+
+@route('/{id:\\d+}/edit')
+def edit_one(environ, start): pass
+
+@route('/{id:\\d+}/{action:[a-z]+}')
+def action(environ, start): pass
+'''
+
+
+def build_tree(root, num_modules):
+    package = os.path.join(root, 'benchpackage')
+    os.makedirs(package)
+    open(os.path.join(package, '__init__.py'), 'w').close()
+    for i in xrange(num_modules):
+        sub = os.path.join(package, 'sub%d' % (i // 50))
+        if not os.path.exists(sub):
+            os.makedirs(sub)
+            open(os.path.join(sub, '__init__.py'), 'w').close()
+        with open(os.path.join(sub, 'mod%d.py' % i), 'w') as fh:
+            fh.write(MODULE_SOURCE)
+
+
+def run_once(root, intern):
+    sys.path.insert(0, root)
+    from webstar import Router
+    from webstar.pattern import Pattern
+    Pattern.intern = intern
+    
+    # Import everything first so that we only time the registration.
+    router = Router()
+    router.register_package(None, 'benchpackage', recursive=True)
+    Pattern.clear_compile_cache()
+    
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    routers = []
+    for i in xrange(5):
+        router = Router()
+        router.register_package(None, 'benchpackage', recursive=True)
+        routers.append(router)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    print 'intern=%-5s %8.1fms per register_package, %6d KB maxrss growth, %d compiled' % (
+        intern, 1000 * elapsed / 5, after - before, len(Pattern._compile_cache))
+
+
+def main():
+    num_modules = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    if len(sys.argv) > 2:
+        run_once(sys.argv[2], sys.argv[3] == 'True')
+        return
+    root = tempfile.mkdtemp()
+    try:
+        build_tree(root, num_modules)
+        print '%d modules, %d routes each' % (num_modules, MODULE_SOURCE.count('@route'))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env.get('PYTHONPATH', '')])
+        for intern in (False, True):
+            # Fresh processes so the memory numbers are independent.
+            subprocess.check_call([sys.executable, __file__, str(num_modules), root, str(intern)], env=env)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Routing a log's worth of paths with `route_many`, versus a loop of
+`route` calls; both for a skewed mix with plenty of repeats, and for paths
+which are all unique (where `route_many` has nothing to share).
+
+    python benchmarks/route_many.py [num_paths]
+
+"""
+
+import random
+import sys
+import time
+
+from webstar import Router
+
+
+def build():
+    root = Router()
+    for i in xrange(20):
+        section = root.register('/section%d' % i, Router())
+        section.register('/', 'index')
+        section.register('/edit', 'edit')
+        for j in xrange(10):
+            section.register('/{id:int}/action%d' % j, 'action')
+        section.register('/{slug:slug}', 'slug')
+    root.register('/{page}', 'page')
+    return root
+
+
+def make_paths(count):
+    rand = random.Random(0)
+    paths = []
+    for i in xrange(count):
+        # A skewed mix, like real traffic; plenty of repeats and misses.
+        section = int(rand.paretovariate(1.2)) % 25
+        kind = rand.random()
+        if kind < 0.4:
+            paths.append('/section%d/%d/action%d' % (section, rand.randint(1, 50), rand.randint(0, 9)))
+        elif kind < 0.7:
+            paths.append('/section%d/post-%d' % (section, int(rand.paretovariate(1.0))))
+        elif kind < 0.9:
+            paths.append('/section%d/edit' % section)
+        else:
+            paths.append('/missing/%d' % rand.randint(1, 1000))
+    return paths
+
+
+def make_unique_paths(count):
+    rand = random.Random(0)
+    paths = []
+    for i in xrange(count):
+        section = rand.randint(0, 24)
+        if i % 2:
+            paths.append('/section%d/%d/action%d' % (section, i, rand.randint(0, 9)))
+        else:
+            paths.append('/section%d/post-%d' % (section, i))
+    return paths
+
+
+def compare(root, paths):
+    count = len(paths)
+    print '%d paths, %d unique' % (count, len(set(paths)))
+    
+    # Neither holds onto its routes while it is timed, so that neither pays
+    # for the garbage collector walking the other's.
+    start = time.time()
+    for path in paths:
+        root.route(path)
+    naive_time = time.time() - start
+    
+    start = time.time()
+    for route in root.route_many(paths):
+        pass
+    bulk_time = time.time() - start
+    
+    assert list(root.route_many(paths)) == [root.route(path) for path in paths]
+    print 'route loop: %.2fs (%.0f/s)' % (naive_time, count / naive_time)
+    print 'route_many: %.2fs (%.0f/s)' % (bulk_time, count / bulk_time)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    root = build()
+    compare(root, make_paths(count))
+    print
+    compare(root, make_unique_paths(count))
+
+
+if __name__ == '__main__':
+    main()
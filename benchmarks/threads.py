@@ -0,0 +1,74 @@
+"""Throughput of `route` and `url_for` as threads are added.
+
+    python benchmarks/threads.py [duration]
+
+Under the GIL, throughput should hold steady as threads are added (it cannot
+grow); a drop would mean the threads are contending for something. Where the
+interpreter was built without the GIL (ie. free-threaded CPython), it should
+instead grow with the number of cores.
+
+"""
+
+import sys
+import threading
+import time
+
+from webstar import Router
+from webstar.metrics import RouteMetrics
+
+
+def app(environ, start):
+    return []
+
+
+def build():
+    root = Router()
+    for i in xrange(20):
+        section = root.register('/section%d' % i, Router(), section=i)
+        section.register('/{id:int}', app)
+        section.register('/{id:int}/edit', app, action='edit')
+    return root
+
+
+def measure(func, num_threads, duration):
+    counts = [0] * num_threads
+    stop = threading.Event()
+    def target(index):
+        count = 0
+        while not stop.is_set():
+            for i in xrange(100):
+                func()
+            count += 100
+        counts[index] = count
+    threads = [threading.Thread(target=target, args=(i, )) for i in xrange(num_threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.time() - start)
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print 'Python %s (%s)' % (sys.version.split()[0], 'GIL' if gil else 'free-threaded')
+    
+    root = build()
+    metrics = RouteMetrics(root)
+    environ = {'PATH_INFO': '/section19/123', 'SCRIPT_NAME': '', 'REQUEST_METHOD': 'GET'}
+    start = lambda status, headers: None
+    cases = [
+        ('route', lambda: root.route('/section19/123')),
+        ('url_for', lambda: root.url_for(section=19, id=123, action='edit')),
+        ('metrics', lambda: metrics(dict(environ), start).close()),
+    ]
+    for name, func in cases:
+        for num_threads in (1, 2, 4, 8, 16):
+            print '%-8s %2d threads: %8.0f/s' % (name, num_threads, measure(func, num_threads, duration))
+
+
+if __name__ == '__main__':
+    main()
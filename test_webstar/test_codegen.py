@@ -0,0 +1,68 @@
+import datetime
+
+from . import *
+from webstar.core import gating
+from webstar.router import Router
+
+
+class TestCodegen(TestCase):
+    
+    def setUp(self):
+        self.router = router = Router()
+        router.register('/', EchoApp('index'), page='index')
+        router.register('/about', EchoApp('about'))
+        router.register('/posts/{id:int}', EchoApp('post'), defaults=dict(format='html'))
+        router.register('/posts/{id:int}.{format}', EchoApp('post'))
+        router.register('/{year:\d{4}}/{day:date}', EchoApp('day'), section=object())
+        self.sub = router.register('/sub', Router())
+        self.sub.register('/{x}', EchoApp('sub'))
+        router.register('/n/{id:int}', EchoApp('short'), _requirements=dict(id=r'\d{1,3}'))
+        router.register('/{name}', EchoApp('named'), _requirements=dict(name='[a-z]+'),
+            _parsers=dict(name=gating(str.upper)))
+        router.register(None, EchoApp('fallback'))
+        self.paths = ['/', '/about', '/about/more', '/aboutness', '/posts/12',
+            '/posts/12.json', '/posts/x', '/2012/2012-02-29', '/2011/2011-02-29',
+            '/abc', '/ABC', '/sub/1', '/sub', '/about\n', '', '/n/12', '/n/1234']
+    
+    def test_same_steps(self):
+        expected = [list(self.router.reference_route_step(path)) for path in self.paths]
+        self.router.compile()
+        self.assertTrue(self.router._matcher is not None)
+        self.assertTrue(self.sub._matcher is not None)
+        actual = [list(self.router.route_step(path)) for path in self.paths]
+        self.assertEqual(actual, expected)
+        self.assertEqual(self.router.route('/2012/2012-02-29').data['day'], datetime.date(2012, 2, 29))
+        self.assertEqual(self.router.route('/abc').data, dict(name='ABC'))
+        self.assertEqual(self.router.route('/sub/1').app.output, 'sub')
+        self.assertEqual(self.router.route('/n/12').data, dict(id=12))
+        self.assertEqual(self.router.route('/n/1234').app.output, 'named')
+    
+    def test_source(self):
+        self.router.compile()
+        source = self.router._matcher[1].source
+        self.assertTrue("if path.startswith('/posts/'):" in source)
+        self.assertTrue("data = {'format': 'html'}" in source)
+        self.assertTrue("_base4.copy()" in source)
+    
+    def test_register_reverts(self):
+        self.router.compile()
+        self.router.register('/late', EchoApp('late'), _priority=1)
+        self.assertTrue(self.router._matcher is None)
+        self.assertEqual(self.router.route('/late').app.output, 'late')
+    
+    def test_stale_matcher(self):
+        # As if the sub router published between being compiled and having
+        # its matcher installed.
+        self.router.compile()
+        stale = self.sub._matcher
+        self.sub.register('/late', EchoApp('late'), _priority=1)
+        self.sub._matcher = stale
+        self.assertEqual(self.router.route('/sub/late').app.output, 'late')
+    
+    def test_non_finite_defaults(self):
+        self.router.register('/limited', EchoApp('limited'), _priority=1,
+            defaults=dict(limit=float('inf'), ratio=float('nan')))
+        self.router.compile()
+        data = self.router.route('/limited').data
+        self.assertEqual(data['limit'], float('inf'))
+        self.assertTrue(data['ratio'] != data['ratio'])
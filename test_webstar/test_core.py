@@ -23,4 +23,84 @@ class TestCore(TestCase):
         app = TestApp(router)
         res = app.get('/trailing_slash/')
         self.assertEquals(res.status, '301 Moved Permanently')
-        self.assertEquals(res.headers['Location'], '/trailing_slash')
\ No newline at end of file
+        self.assertEquals(res.headers['Location'], '/trailing_slash')
+    
+    def test_encode_query(self):
+        self.assertEqual(encode_query(dict(b=2, a='x y')), 'a=x+y&b=2')
+        self.assertEqual(encode_query(dict(tag=['a', 'b&c'])), 'tag=a&tag=b%26c')
+        self.assertEqual(encode_query([('b', 1), ('a', 2), ('b', 3)]), 'b=1&a=2&b=3')
+        self.assertEqual(encode_query(dict(name=u'caf\xe9')), 'name=caf%C3%A9')
+        self.assertEqual(encode_query('raw=1'), 'raw=1')
+    
+    def test_url_for_query(self):
+        router = Router()
+        router.register('/{id:int}', EchoApp('view'))
+        self.assertEqual(router.url_for(id=1, _query=dict(page=2)), '/1?page=2')
+        self.assertEqual(router.url_for(id=1, _fragment='top'), '/1#top')
+        self.assertEqual(router.url_for(id=1, _query=[('a', 1)], _fragment='x y'), '/1?a=1#x%20y')
+        self.assertEqual(router.route('/1').url_for(_query=dict(page=3)), '/1?page=3')
+        self.assertEqual(list(router.generate_many([dict(id=2, _query=dict(q='x'))])), ['/2?q=x'])
+
+
+
+class TestCanonical(TestCase):
+    
+    def setUp(self):
+        self.router = Router()
+        self.router.canonicalize = True
+        self.router.register('/{id:int}', EchoApp('number'))
+        swap = dict(a='b', b='a')
+        self.router.register('/loop/{x:[ab]}', EchoApp('loop'),
+            _formatters=dict(x=swap.get))
+        self.app = TestApp(self.router)
+    
+    def test_canonical(self):
+        res = self.app.get('/12')
+        self.assertEqual(res.body, 'number')
+    
+    def test_redirect(self):
+        res = self.app.get('/0012', dict(q='x'), status=301)
+        self.assertEqual(res.headers['Location'], '/12?q=x')
+        res = self.app.post('/0012', status=307)
+        self.assertEqual(res.headers['Location'], '/12')
+        self.assertEqual(self.router._canonical_cache[1], {'/0012': '/12'})
+    
+    def test_loop(self):
+        res = self.app.get('/loop/a')
+        self.assertEqual(res.body, 'loop')
+
+    def test_mounted(self):
+        self.router.register('/static', EchoApp('static'), endpoint='static')
+        res = self.app.get('/static/css/site.css')
+        self.assertEqual(res.body, 'static')
+        res = self.app.get('/0012/more', status=301)
+        self.assertEqual(res.headers['Location'], '/12/more')
+
+    def test_other_endpoint(self):
+        router = Router()
+        router.canonicalize = True
+        router.register('/static', EchoApp('static'), endpoint='static')
+        router.register('/files/{bucket}', EchoApp('files'))
+        app = TestApp(router)
+        self.assertEqual(app.get('/files/x').body, 'files')
+        self.assertEqual(app.get('/files/x/y').body, 'files')
+        self.assertEqual(app.get('/static').body, 'static')
+
+
+class TestPathLimits(TestCase):
+    
+    def test_limits(self):
+        router = Router()
+        router.register('/{a}/{b}', EchoApp('two'))
+        router.register('/{a}', EchoApp('one'))
+        router.max_path_length = 10
+        router.max_path_segments = 1
+        app = TestApp(router)
+        self.assertEqual(app.get('/short').body, 'one')
+        app.get('/' + 'x' * 10, status=414)
+        app.get('/a/b', status=414)
+        router.max_path_segments = 2
+        res = app.get('/a/b/', status=301)
+        self.assertEqual(res.headers['Location'], '/a/b')
+        router.max_path_segments = None
+        self.assertEqual(app.get('/a/b').body, 'two')
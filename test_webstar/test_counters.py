@@ -0,0 +1,31 @@
+import threading
+
+from . import *
+from webstar.counters import ThreadCounter
+
+
+class TestThreadCounter(TestCase):
+    
+    def test_threads(self):
+        counter = ThreadCounter()
+        def target():
+            for i in xrange(10000):
+                counter.add()
+        threads = [threading.Thread(target=target) for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.add(5)
+        self.assertEqual(counter.value, 80005)
+    
+    def test_short_lived_threads(self):
+        counter = ThreadCounter()
+        for i in xrange(200):
+            thread = threading.Thread(target=counter.add, args=(i, ))
+            thread.start()
+            thread.join()
+        # A thread's locals are cleared just after `join` returns, so the
+        # last one may still be live.
+        self.assertTrue(len(counter._shards) <= 1)
+        self.assertEqual(counter.value, sum(xrange(200)))
@@ -0,0 +1,38 @@
+from . import *
+from webstar.footprint import deep_size
+from webstar.router import Router
+
+
+class TestFootprint(TestCase):
+    
+    def test_deep_size(self):
+        inner = ['x' * 1000]
+        self.assertTrue(deep_size([inner]) > 1000)
+        self.assertTrue(deep_size([inner], seen=set([id(inner)])) < 1000)
+        self.assertTrue(deep_size([inner], stop=set([id(inner)])) < 1000)
+        secret = 'y' * 1000
+        def closure():
+            return secret
+        self.assertTrue(deep_size(closure) > 1000)
+    
+    def test_report(self):
+        root = Router()
+        shared = Router()
+        shared.register('/{id:int}', EchoApp('view'))
+        root.register('/a', shared)
+        root.register('/b', shared)
+        for i in xrange(5):
+            root.register('/page%d' % i, EchoApp(i))
+        
+        footprint = root.footprint()
+        self.assertEqual([x[0] for x in footprint.routers], ['/', '/a'])
+        (_, _, root_own, root_total), (_, _, shared_own, shared_total) = footprint.routers
+        self.assertEqual(root_total, root_own + shared_own)
+        self.assertEqual(shared_total, shared_own)
+        self.assertEqual(footprint.total, root_total)
+        self.assertEqual([x[0] for x in footprint.patterns][:3], ['/ /a', '/ /b', '/ /page0'])
+        self.assertEqual(footprint.patterns[-1][0], '/a /{id:int}')
+        
+        duplicates = dict((x[0], x[1]) for x in footprint.duplicates)
+        self.assertEqual(duplicates['Pattern.defaults: 8 copies of {}'], 8)
+        self.assertTrue('Pattern.defaults' in footprint.format())
@@ -0,0 +1,99 @@
+import threading
+
+from . import *
+from webstar.metrics import Histogram, RouteMetrics
+from webstar.router import Router
+
+
+class TestMetrics(TestCase):
+    
+    def test_histogram(self):
+        histogram = Histogram()
+        for i in xrange(1, 1001):
+            histogram.add(i / 1e6)
+        self.assertEqual(histogram.count, 1000)
+        for percent in (50, 99):
+            self.assertTrue(percent * 1e-5 <= histogram.percentile(percent) <= percent * 1.2e-5)
+        self.assertEqual(histogram.percentile(100), 1e-3)
+    
+    def test_middleware(self):
+        root = Router()
+        blog = root.register('/blog', Router())
+        blog.register('/archive/{year:int}', EchoApp('archive'))
+        metrics = RouteMetrics(root)
+        root.register('/_metrics', metrics.export_app)
+        app = TestApp(metrics)
+        
+        app.get('/blog/archive/2011')
+        app.get('/blog/archive/2012')
+        app.get('/nope', status=404)
+        
+        histograms = metrics.snapshot()
+        self.assertEqual(sorted(histograms), ['/blog/archive/{year:int}', '<unrouted>'])
+        route_hist, app_hist = histograms['/blog/archive/{year:int}']
+        self.assertEqual(route_hist.count, 2)
+        self.assertEqual(app_hist.count, 2)
+        
+        body = app.get('/_metrics').body
+        self.assertTrue('webstar_route_seconds_count{route="/blog/archive/{year:int}"} 2' in body)
+        self.assertTrue('webstar_app_seconds_count{route="<unrouted>"} 1' in body)
+    
+    def test_label_cache(self):
+        root = Router()
+        shared = Router()
+        shared.register('/{x}', EchoApp('x'))
+        root.register('/a', shared)
+        root.register('/b', shared)
+        root.register('/c', EchoApp('c'))
+        metrics = RouteMetrics(root)
+        metrics.label_cache_size = 1
+        # Only reached one way, so labelled by the last pattern alone.
+        self.assertEqual(metrics.label(root.route('/c')), '/c')
+        self.assertEqual(metrics._labels, {})
+        # Shared, so labelled by the whole chain.
+        self.assertEqual(metrics.label(root.route('/a/1')), '/a/{x}')
+        self.assertEqual(metrics.label(root.route('/a/2')), '/a/{x}')
+        self.assertEqual(len(metrics._labels), 1)
+        self.assertEqual(metrics.label(root.route('/b/1')), '/b/{x}')
+        self.assertEqual(metrics._labels.values(), ['/b/{x}'])
+        root.register('/d', EchoApp('d'))
+        self.assertEqual(metrics.label(root.route('/d')), '/d')
+    
+    def test_response_types(self):
+        def iter_app(environ, start):
+            start('200 OK', [('Content-Type', 'text/plain')])
+            return iter(['iter'])
+        root = Router()
+        root.register('/list', EchoApp('list'))
+        root.register('/iter', iter_app)
+        metrics = RouteMetrics(root)
+        app = TestApp(metrics)
+        app.get('/list')
+        app.get('/iter')
+        histograms = metrics.snapshot()
+        self.assertEqual(histograms['/list'][1].count, 1)
+        self.assertEqual(histograms['/iter'][1].count, 1)
+    
+    def test_threads(self):
+        metrics = RouteMetrics(Router())
+        def target():
+            for i in xrange(1000):
+                metrics.record('a', 1e-6, 2e-6)
+        threads = [threading.Thread(target=target) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.record('b', 1e-6, 2e-6)
+        histograms = metrics.snapshot()
+        self.assertEqual(histograms['a'][0].count, 4000)
+        self.assertEqual(histograms['b'][1].count, 1)
+    
+    def test_short_lived_threads(self):
+        metrics = RouteMetrics(Router())
+        for i in xrange(200):
+            thread = threading.Thread(target=metrics.record, args=('a', 1e-6, 2e-6))
+            thread.start()
+            thread.join()
+        self.assertTrue(len(metrics._shards) <= 1)
+        self.assertEqual(metrics.snapshot()['a'][1].count, 200)
@@ -1,4 +1,7 @@
 
+import datetime
+import uuid
+
 from . import *
 from webstar.core import *
 from webstar.pattern import *
@@ -62,6 +65,14 @@ class TestPattern(TestCase):
         m = p.match('/notanumber')
         self.assertEqual(m, None)
     
+    def test_nitrogen_requirements_with_converter(self):
+        # Requirements see the captured string, not the converted int.
+        p = Pattern('/{id:int}', _requirements=dict(id=r'\d{1,3}'))
+        self.assertEqual(p.match('/12'), (dict(id=12), ''))
+        self.assertEqual(p.match('/1234'), None)
+        self.assertEqual(p.format(id=12), '/12')
+        self.assertRaises(FormatMatchError, p.format, id=1234)
+    
     def test_nitrogen_parsers(self):
         p = Pattern('/{id}', _parsers=dict(id=int))
         data, path = p.match('/12')
@@ -147,4 +158,73 @@ class TestPattern(TestCase):
         self.assertEqual(p.match(''), None)
         self.assertNotEqual(p.match('/'), None)
         self.assertEqual(p.match('/notempty'), None)
-            
+
+    def test_int_converter(self):
+        p = Pattern('/{id:int}')
+        data, path = p.match('/12')
+        self.assertEqual(data, dict(id=12))
+        self.assertEqual(p.match('/notanumber'), None)
+        self.assertEqual(p.format(id=12), '/12')
+        self.assertEqual(p.format(id='12'), '/12')
+        self.assertRaises(FormatMatchError, p.format, id='notanumber')
+    
+    def test_converter_format_string(self):
+        p = Pattern('/{year:int:04d}')
+        self.assertEqual(p.match('/0012')[0], dict(year=12))
+        self.assertEqual(p.format(year=12), '/0012')
+    
+    def test_date_converter(self):
+        p = Pattern('/{day:date}')
+        data, path = p.match('/2012-02-29')
+        self.assertEqual(data, dict(day=datetime.date(2012, 2, 29)))
+        self.assertEqual(p.match('/2011-02-29'), None)
+        self.assertEqual(p.format(day=datetime.date(1066, 10, 14)), '/1066-10-14')
+    
+    def test_uuid_and_slug_converters(self):
+        p = Pattern('/{id:uuid}/{name:slug}')
+        id = uuid.UUID('12345678-1234-5678-1234-567812345678')
+        data, path = p.match('/%s/hello-world' % id)
+        self.assertEqual(data, dict(id=id, name='hello-world'))
+        self.assertEqual(p.format(id=id, name='hello-world'), '/%s/hello-world' % id)
+        self.assertEqual(p.match('/%s/Hello_World' % id), None)
+    
+    def test_interning(self):
+        a = Pattern('/{id:int}', defaults=dict(id=1))
+        b = Pattern('/{id:int}', kind='b')
+        self.assertTrue(a._compiled is b._compiled)
+        self.assertEqual(a.match('/2')[0], dict(id=2))
+        self.assertEqual(b.match('/2')[0], dict(id=2, kind='b'))
+        self.assertEqual(a.format(), '/1')
+        self.assertRaises(FormatKeyError, b.format, kind='b')
+    
+    def test_compile_cache_max(self):
+        class Small(Pattern):
+            _compile_cache = {}
+            _problems_cache = {}
+            _compile_cache_max = 4
+        for i in xrange(10):
+            p = Small('/%d/{id:int}' % i)
+            self.assertTrue(len(Small._compile_cache) <= 4)
+            self.assertEqual(p.match('/%d/12' % i)[0], dict(id=12))
+        self.assertEqual(len(Small._problems_cache), 1)
+
+    
+    def test_check_regex(self):
+        for regex in (r'[^/]+', r'\d+', r'(?:/[^/]+)+', r'[a-z0-9]+(?:-[a-z0-9]+)*',
+            converters['uuid'].pattern, r'(?P<a>[^/]+)-(?P<b>[^/]+)(?=/|$)',
+            r'(?:[^/]+/)*[^/]+', r'(?:ab|cd|ae)+', r'(?:a|ab)+', r'(?:\d{1,3}\.)+'):
+            self.assertEqual(check_regex(regex), [], regex)
+        for regex in (r'(a+)+', r'(\w+\s?)+$', r'(?:[^/]+/?)*x', r'(?:\w|\d)+',
+            r'(a|aa)+', r'(\w|\w\w)+', r'(?:aa|b|a)+', r'(?:a+a)+', r'(a*)*'):
+            self.assertTrue(any('exponentially' in x for x in check_regex(regex)), regex)
+        self.assertEqual(check_regex(r'\d+\d+'),
+            ['adjacent quantifiers may backtrack polynomially'])
+    
+    def test_strict(self):
+        self.assertRaises(UnsafePatternError, Pattern, r'/{x:(a+)+}', _strict=True)
+        self.assertRaises(UnsafePatternError, Pattern, r'/{x}',
+            _requirements=dict(x=r'(\w+\s?)+'), _strict=True)
+        # Only warnings when not strict, or when merely polynomial.
+        Pattern(r'/{x:(a+)+}')
+        p = Pattern(r'/{a:\d+}{b:\d+}', _strict=True)
+        self.assertEqual(p.match('/123')[0], dict(a='12', b='3'))
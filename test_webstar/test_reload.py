@@ -0,0 +1,70 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from . import *
+from webstar.core import RouteAttrResolver
+from webstar.reload import Reloader
+from webstar.router import Router
+
+
+MODULE_SOURCE = '''
+from webstar import route
+from test_webstar import EchoApp
+
+__app__ = EchoApp(%(name)r)
+
+@route('/%(name)s')
+def view(environ, start):
+    pass
+'''
+
+
+class TestReloader(TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.package = os.path.join(self.dir, 'reloadpackage')
+        os.makedirs(self.package)
+        open(os.path.join(self.package, '__init__.py'), 'w').close()
+        self.write('a', 'first')
+        self.write('b', 'untouched')
+        sys.path.insert(0, self.dir)
+    
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        for name in sys.modules.keys():
+            if name.startswith('reloadpackage'):
+                del sys.modules[name]
+        shutil.rmtree(self.dir)
+    
+    def write(self, module, name):
+        path = os.path.join(self.package, module + '.py')
+        with open(path, 'w') as fh:
+            fh.write(MODULE_SOURCE % dict(name=name))
+        # Make sure the change is visible, even within the same second.
+        mtime = time.time() + getattr(self, 'mtime_offset', 0)
+        self.mtime_offset = getattr(self, 'mtime_offset', 0) + 10
+        os.utime(path, (mtime, mtime))
+    
+    def test_reload(self):
+        root = Router()
+        root.register_package(None, 'reloadpackage')
+        untouched = sys.modules['reloadpackage.b'].__router__
+        resolver = RouteAttrResolver()
+        reloader = Reloader(root, caches=[resolver])
+        
+        self.assertEqual(root.route('/a').app.output, 'first')
+        self.assertEqual(reloader.check(), [])
+        
+        self.write('a', 'second')
+        self.assertEqual(reloader.check(), [sys.modules['reloadpackage.a']])
+        self.assertEqual(root.route('/a').app.output, 'second')
+        self.assertEqual(root.route('/a/second').app.__name__, 'view')
+        self.assertEqual(root.route('/a/first').app.output, 'second')
+        
+        # The other module was left alone.
+        self.assertTrue(sys.modules['reloadpackage.b'].__router__ is untouched)
+        self.assertEqual(reloader.check(), [])
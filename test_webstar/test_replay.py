@@ -0,0 +1,34 @@
+from . import *
+from webstar.replay import count_backtracks, read_paths, replay
+from webstar.router import Router
+
+
+class TestReplay(TestCase):
+    
+    def setUp(self):
+        self.router = Router()
+        a = self.router.register('/{section}', Router())
+        a.register('/a', EchoApp('a'))
+        self.router.register('/x/{b}', EchoApp('b'))
+    
+    def test_read_paths(self):
+        lines = [
+            '/bare/path\n',
+            '127.0.0.1 - - [19/Oct/2012:13:55:36 -0700] "GET /logged?q=1 HTTP/1.1" 200 2326\n',
+            'garbage\n',
+        ]
+        self.assertEqual(list(read_paths(lines)), ['/bare/path', '/logged'])
+    
+    def test_backtracks(self):
+        self.assertEqual(count_backtracks(self.router, '/x/a'), 0)
+        self.assertEqual(count_backtracks(self.router, '/x/b'), 1)
+    
+    def test_replay(self):
+        paths = ['/x/a', '/x/b', '/nope'] * 10
+        for wsgi in (False, True):
+            for threads in (1, 3):
+                stats = replay(self.router, paths, wsgi=wsgi, threads=threads, num_slowest=2)
+                self.assertEqual(stats.count, 30)
+                self.assertEqual(stats.not_found, 10)
+                self.assertEqual(len(stats.slowest), 2)
+        self.assertTrue('404s: 10 (33.33%)' in stats.format(self.router))
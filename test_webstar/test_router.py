@@ -1,8 +1,18 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+
   
 from . import *
 from webstar.core import *
 from webstar import core
+from webstar import discovery
+from webstar.discovery import DiscoveryIndex, find_module_names
+from webstar.pattern import Pattern
 from webstar.router import Router
+from webstar import router as router_module
 
 class TestRouterBasics(TestCase):
     
@@ -24,6 +34,11 @@ class TestRouterBasics(TestCase):
         def numbers(environ, start):
             self.autostart(environ, start)
             return ['number-%d' % get_route_data(environ)['num']]
+        
+        @self.router.register('/dates/{day:date}')
+        def dates(environ, start):
+            self.autostart(environ, start)
+            return ['date-%s' % get_route_data(environ)['day'].strftime('%Y%m%d')]
     
     def test_miss(self):
         res = self.app.get('/notfound', status=404)
@@ -51,6 +66,13 @@ class TestRouterBasics(TestCase):
         path = self.router.url_for(num=314)
         self.assertEqual('/314', path)
     
+    def test_converter(self):
+        res = self.app.get('/dates/2012-10-19')
+        self.assertEqual(res.body, 'date-20121019')
+        self.app.get('/dates/2012-13-19', status=404)
+        path = self.router.url_for(day=datetime.date(2012, 10, 19))
+        self.assertEqual(path, '/dates/2012-10-19')
+    
     def test_gen_mismatch(self):
         path = self.router.url_for(fruit='apple')
         self.assertEqual(path, '/apple')
@@ -137,6 +159,55 @@ class TestRealRecursiveModules(TestRealModules):
         self.assertEqual(res.body, 'I am a leaf')
 
 
+class TestRealRecursiveDispatch(TestRealRecursiveModules):
+    
+    def setUp(self):
+        super(TestRealRecursiveDispatch, self).setUp()
+        self.router.dispatch_threshold = 1
+    
+    def test_dispatched(self):
+        self.router.route('/static')
+        literals, depths, others = self.router._dispatch[1]
+        self.assertEqual(sorted(literals), ['/static', '/sub', '/sub/leaf'])
+        self.assertEqual(depths, (1, 2))
+
+
+class TestDispatch(TestCase):
+    
+    def test_same_steps(self):
+        router = Router()
+        router.register('/{id:int}', EchoApp('number'))
+        for i in xrange(20):
+            router.register('/{pkg:mod%d}' % i, EchoApp(i), defaults=dict(index=i))
+        router.register('/mod3', EchoApp('late'))
+        router.register('/{pkg:mod5}/{sub:x}', EchoApp('deep'), _priority=1)
+        router.register('/{name}', EchoApp('named'))
+        router.register('/{pkg:int}', EchoApp('converter'))
+        paths = ['/', '/12', '/mod3', '/mod3/more', '/mod5/x', '/mod5/xy', '/mod19',
+            '/mod20', '/mod1\n', '/mod5/x\n', '/int', '/other/path']
+        expected = [list(router.reference_route_step(path)) for path in paths]
+        actual = [list(router.route_step(path)) for path in paths]
+        self.assertTrue(router._dispatch[1] is not None)
+        self.assertEqual(actual, expected)
+
+        # Built when published, and the patterns which are always tried are
+        # held once rather than with every literal.
+        apps, (literals, depths, others) = router._dispatch
+        self.assertTrue(apps is router._apps)
+        self.assertEqual(len(others), 3)
+        self.assertEqual(sum(len(x) for x in literals.itervalues()), 22)
+        # Extended one registration at a time, to the same as a full build.
+        self.assertEqual(router._index, router_module._build_dispatch(apps))
+        self.assertEqual(router.route('/mod5/x').app.output, 'deep')
+        self.assertEqual(router.route('/mod7').data, dict(pkg='mod7', index=7))
+        
+        # Falls back under the threshold.
+        router.dispatch_threshold = 100
+        router.register('/extra', EchoApp('extra'))
+        self.assertEqual(router.route('/extra').app.output, 'named')
+        self.assertTrue(router._dispatch[1] is None)
+
+
 class TestTraversal(TestCase):
     
     def test_dont_fail_immediately(self):
@@ -157,4 +228,390 @@ class TestTraversal(TestCase):
         self.assertEqual(res.body, 'catchall')
         
         
-        
\ No newline at end of file
+        
+
+class TestRouteAttrs(TestCase):
+    
+    def setUp(self):
+        self.root = DummyModule('dummy')
+        self.root.__middleware__ = ['package']
+        self.leaf = self.root('leaf')
+        self.leaf.__package__ = 'dummy'
+        self.leaf.__middleware__ = ['module']
+        self.leaf.__app__ = EchoApp('leaf')
+        self.router = Router()
+        self.router.register_package(None, self.root, testing=True, __middleware__=['data'])
+    
+    def tearDown(self):
+        DummyModule.remove_all()
+    
+    def test_resolver(self):
+        route = self.router.route('/leaf')
+        expected = ['data', 'module', 'package']
+        self.assertEqual(core.get_route_attr_list(route, '__middleware__'), expected)
+        
+        resolver = core.RouteAttrResolver()
+        self.assertEqual(resolver.get(route, '__middleware__'), expected)
+        self.assertEqual(resolver.get_many(route, ['__middleware__', 'missing']),
+            dict(__middleware__=expected, missing=[]))
+        
+        self.leaf.__middleware__ = ['changed']
+        self.assertEqual(resolver.get(route, '__middleware__'), expected)
+        resolver.invalidate(self.leaf)
+        self.assertEqual(resolver.get(route, '__middleware__'), ['data', 'changed', 'package'])
+        
+        self.root.__middleware__ = ['changed package']
+        resolver.invalidate(self.root)
+        self.assertEqual(resolver.get(route, '__middleware__'), ['data', 'changed', 'changed package'])
+    
+    def test_resolver_one_walk(self):
+        route = self.router.route('/leaf')
+        walks = []
+        original = core._iter_route_attr_sources
+        def counting(step):
+            walks.append(step)
+            return original(step)
+        core._iter_route_attr_sources = counting
+        try:
+            resolver = core.RouteAttrResolver()
+            resolver.get_many(route, ['__middleware__', 'a', 'b'])
+        finally:
+            core._iter_route_attr_sources = original
+        self.assertEqual(len(walks), len(route))
+
+
+class TestLiveRegistration(TestCase):
+    
+    def test_register_while_routing(self):
+        router = Router()
+        router.register('/static', EchoApp('static'))
+        
+        errors = []
+        done = threading.Event()
+        def reader():
+            try:
+                while not done.is_set():
+                    route = router.route('/static')
+                    if route is None or route.app.output != 'static':
+                        errors.append(route)
+            except Exception as e:
+                errors.append(e)
+        
+        readers = [threading.Thread(target=reader) for i in xrange(4)]
+        for thread in readers:
+            thread.start()
+        try:
+            # Higher priorities are inserted in front of the static route,
+            # which would shift it under any reader iterating the table.
+            for i in xrange(500):
+                router.register('/dynamic%d' % i, EchoApp(i), _priority=i % 3)
+        finally:
+            done.set()
+            for thread in readers:
+                thread.join()
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(len(router.children()), 501)
+        self.assertEqual(router.route('/dynamic499').app.output, 499)
+    
+    def test_batch(self):
+        router = Router()
+        router.register('/{name}', EchoApp('fallback'))
+        generation = router.graph_generation
+        with router.batch():
+            router.register('/a', EchoApp('a'), _priority=1)
+            with router.batch():
+                router.register('/b', EchoApp('b'))
+            # Nothing is visible until the outermost batch ends.
+            self.assertEqual(router.route('/a').app.output, 'fallback')
+            self.assertEqual(router.graph_generation, generation)
+        self.assertNotEqual(router.graph_generation, generation)
+        self.assertEqual(router.route('/a').app.output, 'a')
+        # Equal priorities still respect registration order.
+        self.assertEqual(router.route('/b').app.output, 'fallback')
+        
+        try:
+            with router.batch():
+                router.register('/c', EchoApp('c'), _priority=1)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(router.route('/c').app.output, 'fallback')
+    
+    def test_register_many(self):
+        router = Router()
+        router.register_many([
+            ('/{id:int}', EchoApp('number')),
+            ('/first', EchoApp('first'), dict(_priority=1)),
+            ('/{name}', EchoApp('name'), dict(kind='x')),
+        ])
+        self.assertEqual(router.route('/first').app.output, 'first')
+        self.assertEqual(router.route('/12').app.output, 'number')
+        self.assertEqual(router.route('/abc').data, dict(name='abc', kind='x'))
+        self.assertEqual(len(router.children()), 3)
+
+
+class TestGraphGeneration(TestCase):
+    
+    def test_propagates_to_ancestors_only(self):
+        root = Router()
+        a = root.register('/a', Router())
+        b = root.register('/b', Router())
+        shared = Router()
+        a.register('/s', shared)
+        b.register('/s', shared)
+        other = Router()
+        other.register('/x', EchoApp('x'))
+        
+        before = dict((name, node.graph_generation) for name, node in
+            dict(root=root, a=a, b=b, shared=shared, other=other).iteritems())
+        shared.register('/leaf', EchoApp('leaf'))
+        after = dict((name, node.graph_generation) for name, node in
+            dict(root=root, a=a, b=b, shared=shared, other=other).iteritems())
+        for name in ('root', 'a', 'b', 'shared'):
+            self.assertNotEqual(before[name], after[name], name)
+        self.assertEqual(before['other'], after['other'])
+        
+        # Unrelated registrations do not disturb the root.
+        other.register('/y', EchoApp('y'))
+        self.assertEqual(root.graph_generation, after['root'])
+    
+    def test_generations_are_unique(self):
+        routers = [Router() for i in xrange(8)]
+        seen = []
+        def target(router):
+            for i in xrange(200):
+                router.register('/%d' % i, EchoApp(i))
+                seen.append(router.graph_generation)
+        threads = [threading.Thread(target=target, args=(router, )) for router in routers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(seen)), len(seen))
+
+
+class TestGenerateMany(TestCase):
+    
+    def setUp(self):
+        self.router = Router()
+        shared = Router()
+        shared.register('/{id:int}', EchoApp('view'))
+        shared.register('/{id:int}/edit', EchoApp('edit'), action='edit')
+        blog = self.router.register('/blog', Router(), section='blog')
+        blog.register('/archive/{year:int}/{month:int}', EchoApp('archive'))
+        blog.register('/post', shared)
+        self.router.register('/page', shared, section='page')
+        self.router.register('/about', EchoApp('about'), name='about')
+    
+    def test_chains(self):
+        chains = self.router.url_chains()
+        self.assertEqual([repr(x) for x in chains], [
+            '<URLChain:/blog/archive/{year:int}/{month:int}>',
+            '<URLChain:/blog/post/{id:int}>',
+            '<URLChain:/blog/post/{id:int}/edit>',
+            '<URLChain:/page/{id:int}>',
+            '<URLChain:/page/{id:int}/edit>',
+            '<URLChain:/about>',
+        ])
+        self.assertEqual(chains[0].keys, set(['year', 'month']))
+        self.assertEqual(list(chains[3].generate_many([dict(id=1), dict(x=2)])), ['/page/1', None])
+    
+    def test_matches_generate(self):
+        rows = [
+            dict(year=2012, month=10),
+            dict(id=12),
+            dict(id=12, section='page'),
+            dict(id=12, section='page', action='edit'),
+            dict(name='about'),
+            dict(name='nothing'),
+            dict(),
+        ]
+        self.assertEqual(list(self.router.generate_many(iter(rows))),
+            [self.router.generate(row) for row in rows])
+    
+    def test_missing_generate_children(self):
+        class StepOnly(RouterInterface):
+            def route_step(self, path):
+                return iter(())
+            def generate_step(self, data):
+                return iter(())
+        self.router.register('/custom', StepOnly())
+        self.assertRaises(TypeError, self.router.url_chains)
+        self.assertRaises(TypeError, list, self.router.generate_many([dict(id=1)]))
+
+
+class TestDeferredParsers(TestCase):
+    
+    def build(self, **kwargs):
+        self.calls = []
+        def parser(value):
+            self.calls.append(value)
+            return int(value)
+        router = Router()
+        # This subtree dead-ends for everything, so must be backtracked out of.
+        router.register('/{id}', Router(), _parsers=dict(id=parser), **kwargs)
+        router.register('/{id}', EchoApp('leaf'), _parsers=dict(id=parser), **kwargs)
+        return router
+    
+    def test_immediate(self):
+        router = self.build()
+        self.assertEqual(router.route('/12').data, dict(id=12))
+        self.assertEqual(self.calls, ['12', '12'])
+    
+    def test_deferred(self):
+        router = self.build(_defer_parsers=True)
+        route = router.route('/12')
+        self.assertEqual(route.data, dict(id=12))
+        self.assertEqual(self.calls, ['12'])
+        self.assertEqual(router.url_for(id=12), '/12')
+    
+    def test_gating(self):
+        router = Router()
+        router.register('/{id}', EchoApp('number'), _parsers=dict(id=core.gating(int)), _defer_parsers=True)
+        router.register('/{id}', EchoApp('other'))
+        self.assertEqual(router.route('/12').app.output, 'number')
+        self.assertEqual(router.route('/twelve').app.output, 'other')
+
+
+class CountingRouter(Router):
+    
+    def __init__(self):
+        super(CountingRouter, self).__init__()
+        self.route_calls = 0
+        self.generate_calls = 0
+    
+    def route_step(self, path):
+        self.route_calls += 1
+        return super(CountingRouter, self).route_step(path)
+    
+    def generate_step(self, data):
+        self.generate_calls += 1
+        return super(CountingRouter, self).generate_step(data)
+
+
+class TestCycles(TestCase):
+    
+    def test_register_cycle(self):
+        a = Router()
+        b = a.register('/b', Router())
+        c = b.register('/c', Router())
+        self.assertRaises(GraphCycleError, c.register, '/a', a)
+        self.assertRaises(GraphCycleError, a.register, None, a)
+        a.check_graph()
+    
+    def test_batch_cycle(self):
+        a = Router()
+        b = Router()
+        def build():
+            with a.batch():
+                a.register('/b', b)
+                b.register('/a', a)
+        self.assertRaises(GraphCycleError, build)
+        self.assertEqual(a.children(), [])
+        a.check_graph()
+        b.check_graph()
+    
+    def test_route_cycle(self):
+        a = Router()
+        b = a.register(None, Router())
+        # Sneak a cycle past register.
+        b._publish([((0, 0), Pattern(None), a)], (a, ))
+        self.assertRaises(GraphCycleError, a.check_graph)
+        self.assertRaises(GraphCycleError, a.route, '/anything')
+        self.assertRaises(GraphCycleError, a.url_for, anything='x')
+    
+    def test_shared_subgraph(self):
+        root = Router()
+        shared = CountingRouter()
+        shared.register('/{id:int}/{action}', EchoApp('action'))
+        for i in xrange(5):
+            root.register(None, Router()).register(None, shared)
+        root.register('/{id:int}', EchoApp('view'))
+        
+        self.assertEqual(root.url_for(id=1), '/1')
+        self.assertEqual(shared.generate_calls, 1)
+        self.assertEqual(root.route('/1').app.output, 'view')
+        self.assertEqual(shared.route_calls, 1)
+
+
+class TestDiscovery(TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for path in ('pkg/__init__.py', 'pkg/mod.py', 'pkg/compiled.pyc',
+            'pkg/_protected.py', 'pkg/notes.txt', 'pkg/sub/__init__.pyc',
+            'pkg/data/file.py'):
+            path = os.path.join(self.dir, path)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        self.pkg = os.path.join(self.dir, 'pkg')
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    
+    def test_find_module_names(self):
+        self.assertEqual(find_module_names(self.pkg),
+            set(['mod', 'compiled', '_protected', 'sub']))
+        self.assertEqual(find_module_names(os.path.join(self.dir, 'missing')), set())
+    
+    def test_listdir_fallback(self):
+        stats = []
+        isdir = os.path.isdir
+        def counting_isdir(path):
+            stats.append(os.path.basename(path))
+            return isdir(path)
+        original = discovery.scandir
+        discovery.scandir = None
+        os.path.isdir = counting_isdir
+        try:
+            self.assertEqual(find_module_names(self.pkg),
+                set(['mod', 'compiled', '_protected', 'sub']))
+        finally:
+            discovery.scandir = original
+            os.path.isdir = isdir
+        # Only the names without a dot could be packages.
+        self.assertEqual(sorted(stats), ['data', 'sub'])
+    
+    def test_index(self):
+        index_path = os.path.join(self.dir, 'index')
+        index = DiscoveryIndex(index_path)
+        names = find_module_names(self.pkg, index)
+        index.save()
+        
+        index = DiscoveryIndex(index_path)
+        self.assertEqual(index.get(self.pkg), names)
+        
+        # Turning a directory into a package only touches the subdirectory.
+        data = os.path.join(self.pkg, 'data')
+        open(os.path.join(data, '__init__.py'), 'w').close()
+        os.utime(data, (0, 0))
+        self.assertEqual(index.get(self.pkg), None)
+        self.assertEqual(find_module_names(self.pkg, index), names | set(['data']))
+        self.assertEqual(index.get(self.pkg), names | set(['data']))
+
+
+class TestRouteMany(TestCase):
+    
+    def test_route_many(self):
+        root = Router()
+        blog = root.register('/blog', Router())
+        blog.register('/{id}', Router()).register('/never', EchoApp('never'))
+        blog.register('/{id:int}', EchoApp('post'), _parsers=dict(id=int), _defer_parsers=True)
+        blog.register('/{slug}', EchoApp('slug'))
+        root.register('/about', EchoApp('about'))
+        paths = ['/blog/1', '/about', '/blog/x', '/nope', '/blog/1/', '/blog/2', '/blog/1'] * 3
+        
+        expected = [root.route(path) for path in paths]
+        routes = list(root.route_many(iter(paths), chunk_size=4))
+        self.assertEqual(len(routes), len(expected))
+        for route, other in zip(routes, expected):
+            self.assertEqual(route, other)
+            if route is not None:
+                self.assertEqual(route.data, other.data)
+                self.assertEqual(route[0].unrouted, other[0].unrouted)
+        
+        # Every route has its own data.
+        routes[0][-1].data['id'] = 'changed'
+        self.assertEqual(routes[6].data, dict(id=1))
@@ -0,0 +1,59 @@
+from . import *
+from webstar.router import Router
+from webstar.shadow import Shadow, reference_generate, reference_route
+
+
+class ReversedRouter(Router):
+    
+    """A deliberately broken "optimization", which searches backwards."""
+    
+    def route_step(self, path):
+        for step in reversed(list(Router.route_step(self, path))):
+            yield step
+    
+    def generate_step(self, data):
+        for step in reversed(list(Router.generate_step(self, data))):
+            yield step
+
+
+class TestShadow(TestCase):
+    
+    def build(self, cls):
+        root = Router()
+        root.shadow = Shadow(sample_rate=1)
+        blog = root.register('/blog', cls())
+        blog.register('/{id:int}', EchoApp('post'))
+        blog.register('/{name}', EchoApp('named'))
+        return root, blog
+    
+    def test_agrees(self):
+        root, blog = self.build(Router)
+        self.assertEqual(root.route('/blog/12').app.output, 'post')
+        self.assertEqual(root.route('/missing'), None)
+        self.assertEqual(root.url_for(id=12), '/blog/12')
+        self.assertEqual(reference_route(root, '/blog/12')[-1].head.output, 'post')
+        self.assertEqual(reference_generate(root, dict(name='x')), '/blog/x')
+        shadow = root.shadow
+        self.assertEqual((shadow.routes_checked, shadow.urls_checked), (2, 1))
+        self.assertEqual(shadow.mismatch_count, 0)
+    
+    def test_mismatch(self):
+        root, blog = self.build(ReversedRouter)
+        self.assertEqual(root.route('/blog/12').app.output, 'named')
+        self.assertEqual(root.shadow.mismatch_count, 1)
+        mismatch = root.shadow.mismatches[-1]
+        self.assertEqual((mismatch.kind, mismatch.router, mismatch.input), ('route', root, '/blog/12'))
+        self.assertEqual(mismatch.expected[-1][0].output, 'post')
+        self.assertEqual(mismatch.actual[-1][0].output, 'named')
+        
+        root.generate(id=12, name='x')
+        mismatch = root.shadow.mismatches[-1]
+        self.assertEqual(mismatch.input, dict(id=12, name='x'))
+        self.assertEqual((mismatch.expected, mismatch.actual), ('/blog/12', '/blog/x'))
+    
+    def test_sampling(self):
+        root, blog = self.build(ReversedRouter)
+        root.shadow.sample_rate = 0
+        root.route('/blog/12')
+        self.assertEqual(root.shadow.routes_checked, 0)
+        self.assertEqual(root.shadow.mismatch_count, 0)
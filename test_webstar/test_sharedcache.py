@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+
+from . import *
+from webstar.router import Router
+from webstar.sharedcache import SharedRouteCache
+
+
+class TestSharedRouteCache(TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'routes')
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    
+    def build(self):
+        router = Router()
+        blog = router.register('/blog', Router())
+        # The first candidate dead-ends for months, so they require backtracking.
+        blog.register('/{year:int}', Router()).register('/post-{slug:slug}', EchoApp('post'))
+        blog.register('/{year:int}/{month:int}', EchoApp('month'))
+        router.register('/about', EchoApp('about'))
+        router.route_cache = SharedRouteCache(self.path, slot_count=64)
+        return router
+    
+    def test_shared(self):
+        a = self.build()
+        b = self.build()
+        
+        route = a.route('/blog/2012/10')
+        self.assertEqual(route.app.output, 'month')
+        self.assertEqual(a.route_cache.misses, 1)
+        
+        # The second "process" replays the first's resolution.
+        cached = b.route('/blog/2012/10')
+        self.assertEqual(b.route_cache.hits, 1)
+        self.assertEqual(cached.app.output, 'month')
+        self.assertEqual(cached.data, dict(year=2012, month=10))
+        self.assertEqual([x.consumed for x in cached], [x.consumed for x in route])
+    
+    def test_graph_change(self):
+        a = self.build()
+        b = self.build()
+        a.route('/about')
+        b.register('/other', EchoApp('other'), _priority=1)
+        self.assertEqual(b.route('/about').app.output, 'about')
+        self.assertEqual(b.route_cache.hits, 0)
+    
+    def test_subtree_change(self):
+        a = self.build()
+        b = self.build()
+        a.route('/blog/2012/10')
+        a.route('/about')
+        # As a reload would; only routes through or after the blog are stale.
+        blog = b.children()[0][2]
+        blog.register('/drafts', EchoApp('drafts'))
+        self.assertEqual(b.route('/blog/2012/10').app.output, 'month')
+        self.assertEqual(b.route_cache.hits, 1)
+        self.assertEqual(b.route('/about').app.output, 'about')
+        self.assertEqual(b.route_cache.hits, 1)
+        self.assertEqual(b.route('/blog/drafts').app.output, 'drafts')
+    
+    def test_torn_record(self):
+        a = self.build()
+        a.route('/about')
+        offset = a.route_cache._offset('/about')
+        a.route_cache._mmap[offset + 20] = 'X'
+        self.assertEqual(a.route('/about').app.output, 'about')
+        self.assertEqual(a.route_cache.hits, 0)
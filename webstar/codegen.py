@@ -0,0 +1,188 @@
+"""Compilation of a Router's table of patterns into a specialized Python
+function, instead of interpreting each Pattern for every path.
+
+    >>> root.compile() # Compiles every Router below the root as well.
+    >>> print root._matcher[1].source
+
+The generated `route_step` checks the literal prefix of each pattern with
+`startswith` before touching its regex (and skips the regex entirely for
+patterns without any captures), and builds the route data from dict literals
+of the defaults and constants, rather than copying and updating them. It
+yields exactly the RouteSteps that the interpreted `Router.route_step` would.
+
+A compiled table is only good for as long as it is unchanged; registering on
+(or replacing within) a router drops it back to the interpreted search. The
+router holds it as (apps, route_step), and only uses it while `apps` is still
+its current table.
+
+"""
+
+import linecache
+import math
+
+from . import core
+from . import pattern as patmod
+
+
+_literal_types = (str, unicode, int, long, float, bool, type(None))
+
+
+def _is_literal(value):
+    if type(value) in (tuple, frozenset):
+        return all(_is_literal(x) for x in value)
+    if type(value) is float:
+        # Their reprs ("inf", "nan") are not Python literals.
+        return not (math.isinf(value) or math.isnan(value))
+    return type(value) in _literal_types
+
+
+def _literal_prefix(pattern):
+    m = pattern.token_re.search(pattern._raw)
+    return pattern._raw[:m.start()] if m else pattern._raw
+
+
+class _Writer(object):
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {}
+        self.indent = 0
+
+    def line(self, text, *args):
+        self.lines.append('    ' * self.indent + (text % args if args else text))
+
+    def name(self, prefix, index, value):
+        name = '_%s%d' % (prefix, index)
+        self.namespace[name] = value
+        return name
+
+
+def generate_source(router, apps=None):
+    """Return (source, namespace) for a `route_step` function specialized to
+    the given table, or the router's current one.
+
+    """
+    if apps is None:
+        apps = router._apps
+    w = _Writer()
+    w.namespace.update(
+        _router=router,
+        _make_step=core.RouteStep._make,
+        _normalize=core.normalize_path,
+    )
+    w.line('def route_step(path):')
+    w.indent += 1
+    w.line('"""Generated for %r."""' % router)
+    for i, (_, pattern, node) in enumerate(apps):
+        w.line('')
+        w.line('# %d: %r -> %r', i, getattr(pattern, '_raw', pattern), node)
+        w.name('pattern', i, pattern)
+        w.name('node', i, node)
+        if type(pattern) is patmod.Pattern:
+            _write_pattern(w, i, pattern)
+        else:
+            _write_generic(w, i)
+    w.line('return')
+    w.line('yield')
+    return '\n'.join(w.lines) + '\n', w.namespace
+
+
+def _write_generic(w, i):
+    w.line('m = _pattern%d.match(path)', i)
+    w.line('if m is not None:')
+    w.indent += 1
+    w.line('data, unrouted = m')
+    _write_yield(w, i, 'data')
+    w.indent -= 1
+
+
+def _write_yield(w, i, data):
+    w.line('yield _make_step((_node%d, path[:-len(unrouted)] if unrouted else path, '
+        '_normalize(unrouted), %s, _router, _pattern%d))', i, data, i)
+
+
+def _write_pattern(w, i, pattern):
+    base = pattern.defaults.copy()
+    base.update(pattern.constants)
+    if all(_is_literal(x) for x in base.iteritems()):
+        base_expr = repr(base)
+    else:
+        base_expr = w.name('base', i, base) + '.copy()'
+
+    indent = w.indent
+    prefix = _literal_prefix(pattern)
+
+    if not pattern._keys:
+        # Nothing to capture; the regex would only check for the literal
+        # followed by a slash or the end (which `$` allows a newline before).
+        w.line('if path == %r or path.startswith(%r) or path == %r:',
+            prefix, prefix + '/', prefix + '\n')
+        w.indent += 1
+        w.line('unrouted = path[%d:]', len(prefix))
+        w.line('data = %s', base_expr)
+        if pattern.requirements:
+            # There are no captures, so the data is already the raw data.
+            w.line('if %s:', _tests(w, i, 'requirement', pattern.requirements, 'data'))
+            w.indent += 1
+    else:
+        if prefix:
+            w.line('if path.startswith(%r):', prefix)
+            w.indent += 1
+        w.line('m = %s(path)', w.name('match', i, pattern._compiled.match))
+        w.line('if m is not None:')
+        w.indent += 1
+        captured = 'm.groupdict()'
+        if pattern.requirements:
+            # Requirements see the captured strings, before any conversion.
+            w.line('captured = m.groupdict()')
+            w.line('raw = %s', base_expr)
+            w.line('raw.update(captured)')
+            w.line('if %s:', _tests(w, i, 'requirement', pattern.requirements, 'raw'))
+            w.indent += 1
+            captured = 'captured'
+        if pattern._converters:
+            if captured != 'captured':
+                w.line('captured = m.groupdict()')
+            w.line('try:')
+            w.indent += 1
+            for j, (name, converter, _) in enumerate(pattern._converters):
+                parse = w.name('parse%d_' % i, j, converter.parse)
+                w.line('captured[%r] = %s(captured[%r])', name, parse, name)
+            w.indent -= 1
+            w.line('except ValueError:')
+            w.line('    captured = None')
+            w.line('if captured is not None:')
+            w.indent += 1
+            captured = 'captured'
+        if base:
+            w.line('data = %s', base_expr)
+            w.line('data.update(%s)', captured)
+        else:
+            w.line('data = %s', captured)
+        w.line('unrouted = path[m.end():]')
+
+    if pattern.predicates:
+        w.line('if %s:', _tests(w, i, 'predicate', pattern.predicates, 'data'))
+        w.indent += 1
+    _write_yield(w, i, 'data')
+    w.indent = indent
+
+
+def _tests(w, i, kind, funcs, data):
+    return ' and '.join(w.name('%s%d_' % (kind, i), j, func) + '(%s)' % data
+        for j, func in enumerate(funcs))
+
+
+def compile_router(router, apps=None):
+    """Return a `route_step` function generated for the given table, or the
+    router's current one; its source is available as its `source` attribute.
+
+    """
+    source, namespace = generate_source(router, apps)
+    filename = '<webstar.codegen for %r>' % router
+    exec compile(source, filename, 'exec') in namespace
+    # So that tracebacks (and `inspect`) can show the generated source.
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    func = namespace['route_step']
+    func.source = source
+    return func
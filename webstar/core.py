@@ -9,10 +9,15 @@ watching how it changes as it passes through various routers.
 
 import abc
 import collections
+import itertools
 import logging
 import posixpath
 import re
+import sre_constants
+import sre_parse
 import sys
+import urllib
+import weakref
 
 
 log = logging.getLogger(__name__)
@@ -32,12 +37,13 @@ def normalize_path(*segments):
 
 
 
-_RouteStep = collections.namedtuple('RouteStep', 'head consumed unrouted data router')
+_RouteStep = collections.namedtuple('RouteStep', 'head consumed unrouted data router pattern')
 class RouteStep(_RouteStep):
     def __new__(cls, **kwargs):
         with_defaults = dict(
             consumed='',
             data={},
+            pattern=None,
         )
         with_defaults.update(kwargs)
         return super(RouteStep, cls).__new__(cls, **with_defaults)
@@ -74,7 +80,7 @@ class Route(list):
         ))
         self.extend(steps)
     
-    def step(self, head, consumed='', unrouted=None, data=None, router=None):
+    def step(self, head, consumed='', unrouted=None, data=None, router=None, pattern=None):
         if unrouted is None and self.unrouted.startswith(consumed):
             unrouted = normalize_path(self.unrouted[len(consumed):])
         self.append(RouteStep(
@@ -82,10 +88,11 @@ class Route(list):
             head=head,
             consumed=consumed,
             data=data or {},
-            router=router
+            router=router,
+            pattern=pattern,
         ))
     
-    def url_for(self, _strict=True, **kwargs):
+    def url_for(self, _strict=True, _query=None, _fragment=None, **kwargs):
         for i, chunk in enumerate(self):
             if chunk.router is not None:
                 data = self.data.copy()
@@ -93,6 +100,8 @@ class Route(list):
                 url = chunk.router.generate(data)
                 if _strict and not url:
                     raise GenerationError('could not generate URL for %r, relative to %r' % (data, self[0].unrouted))
+                if url:
+                    url = append_query(url, _query, _fragment)
                 return url
         if _strict:
             raise GenerationError('no routers')
@@ -120,6 +129,77 @@ class Route(list):
         return '<%s:%s>' % (self.__class__.__name__, list.__repr__(self))
         
 
+# Quoted "key=" prefixes, by the sorted key tuple of query dicts. Generated
+# URLs tend to reuse the same few sets of keys over and over again.
+_query_prefixes = {}
+_query_prefixes_max = 1000
+
+
+def _quote_query_value(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    elif not isinstance(value, str):
+        value = str(value)
+    return urllib.quote_plus(value)
+
+
+def encode_query(query):
+    """Encode a dict, or a list of pairs, as a query string.
+    
+    Dicts are encoded in sorted order, so that the same data always gives the
+    same URL; a list or tuple value repeats its key for each item.
+    
+    """
+    
+    if isinstance(query, basestring):
+        return query
+    
+    if isinstance(query, dict):
+        names = tuple(sorted(query))
+        prefixes = _query_prefixes.get(names)
+        if prefixes is None:
+            if len(_query_prefixes) >= _query_prefixes_max:
+                _query_prefixes.clear()
+            prefixes = _query_prefixes[names] = tuple(
+                _quote_query_value(name) + '=' for name in names)
+        values = [query[name] for name in names]
+    else:
+        prefixes = []
+        values = []
+        for name, value in query:
+            prefixes.append(_quote_query_value(name) + '=')
+            values.append(value)
+    
+    out = []
+    for prefix, value in zip(prefixes, values):
+        if isinstance(value, (list, tuple)):
+            out.extend(prefix + _quote_query_value(x) for x in value)
+        else:
+            out.append(prefix + _quote_query_value(value))
+    return '&'.join(out)
+
+
+def append_query(url, query=None, fragment=None):
+    """Append an encoded query and fragment (if given) to a URL."""
+    if query:
+        query = encode_query(query)
+        if query:
+            url += ('&' if '?' in url else '?') + query
+    if fragment:
+        if isinstance(fragment, unicode):
+            fragment = fragment.encode('utf8')
+        url += '#' + urllib.quote(fragment, safe="/?:@!$&'()*+,;=~")
+    return url
+
+
+def _pop_url_args(data):
+    """Return (data, query, fragment); the data is copied if it had either."""
+    if '_query' not in data and '_fragment' not in data:
+        return data, None, None
+    data = dict(data)
+    return data, data.pop('_query', None), data.pop('_fragment', None)
+
+
 def get_route_data(environ):
     route = environ.get(HISTORY_ENVIRON_KEY, None)
     return route.data if route else {}
@@ -129,6 +209,10 @@ class GenerationError(ValueError):
     pass
 
 
+class GraphCycleError(ValueError):
+    pass
+
+
 class FormatError(Exception):
     pass
 class FormatKeyError(FormatError, KeyError): pass
@@ -139,14 +223,359 @@ class FormatPredicateError(FormatError, ValueError): pass
 class FormatDataEqualityError(FormatError, ValueError): pass
 
 
+def gating(func):
+    """Wrap a parser as one which must run while matching, even when parsers
+    are deferred, so that a ValueError from it rejects the match.
+    
+    """
+    def _gating(value):
+        return func(value)
+    _gating.__name__ = 'gating<%s>' % getattr(func, '__name__', func)
+    _gating.gates_match = True
+    return _gating
+
+
+class UnsafePatternError(ValueError):
+    pass
+
+
+_MAXREPEAT = getattr(sre_constants, 'MAXREPEAT', 65535)
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+_ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+_CATEGORY_CHARS = {
+    sre_constants.CATEGORY_DIGIT: '0123456789',
+    sre_constants.CATEGORY_SPACE: ' \t\n\r\f\v',
+    sre_constants.CATEGORY_WORD: 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_',
+}
+
+
+# Character sets are (negated, chars) pairs; ie. "anything but chars" when
+# negated.
+_ANY_CHAR = (True, frozenset())
+_NO_CHARS = (False, frozenset())
+
+
+def _union(a, b):
+    if a[0] and b[0]:
+        return True, a[1] & b[1]
+    if a[0] or b[0]:
+        neg, pos = (a, b) if a[0] else (b, a)
+        return True, neg[1] - pos[1]
+    return False, a[1] | b[1]
+
+
+def _overlaps(a, b):
+    if a[0] and b[0]:
+        return True
+    if a[0] or b[0]:
+        neg, pos = (a, b) if a[0] else (b, a)
+        return bool(pos[1] - neg[1])
+    return bool(a[1] & b[1])
+
+
+def _set_chars(items):
+    negated = False
+    chars = set()
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negated = True
+        elif op == sre_constants.LITERAL:
+            chars.add(unichr(av))
+        elif op == sre_constants.RANGE and av[1] - av[0] < 256:
+            chars.update(unichr(x) for x in xrange(av[0], av[1] + 1))
+        elif op == sre_constants.CATEGORY and av in _CATEGORY_CHARS:
+            chars.update(_CATEGORY_CHARS[av])
+        else:
+            # Negated categories, wide ranges, etc.
+            return _ANY_CHAR
+    return negated, frozenset(chars)
+
+
+def _first_chars(items):
+    """Return (chars, nullable) for a parsed regex; the character set which
+    it may start with, and if it may match nothing at all.
+    
+    """
+    chars = _NO_CHARS
+    for op, av in items:
+        if op in _ZERO_WIDTH:
+            continue
+        if op == sre_constants.LITERAL:
+            return _union(chars, (False, frozenset([unichr(av)]))), False
+        if op == sre_constants.NOT_LITERAL:
+            return _union(chars, (True, frozenset([unichr(av)]))), False
+        if op == sre_constants.IN:
+            return _union(chars, _set_chars(av)), False
+        if op in _REPEATS:
+            sub, nullable = _first_chars(av[2])
+            nullable = nullable or not av[0]
+        elif op == sre_constants.SUBPATTERN:
+            sub, nullable = _first_chars(av[-1])
+        elif op == sre_constants.BRANCH:
+            sub, nullable = _NO_CHARS, False
+            for branch in av[1]:
+                branch_chars, branch_nullable = _first_chars(branch)
+                sub = _union(sub, branch_chars)
+                nullable = nullable or branch_nullable
+        else:
+            # ANY, GROUPREF, etc.
+            return _ANY_CHAR, False
+        chars = _union(chars, sub)
+        if not nullable:
+            return chars, False
+    return chars, True
+
+
+def _single_chars(op, av):
+    """Return the character set of a one-character item, or None."""
+    if op == sre_constants.LITERAL:
+        return False, frozenset([unichr(av)])
+    if op == sre_constants.NOT_LITERAL:
+        return True, frozenset([unichr(av)])
+    if op == sre_constants.IN:
+        return _set_chars(av)
+    if op == sre_constants.ANY:
+        return _ANY_CHAR
+
+
+def _all_chars(items):
+    """Return the set of every character a parsed regex may consume."""
+    chars = _NO_CHARS
+    for op, av in items:
+        if op in _ZERO_WIDTH:
+            continue
+        single = _single_chars(op, av)
+        if single is not None:
+            chars = _union(chars, single)
+        elif op in _REPEATS:
+            chars = _union(chars, _all_chars(av[2]))
+        elif op == sre_constants.SUBPATTERN:
+            chars = _union(chars, _all_chars(av[-1]))
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                chars = _union(chars, _all_chars(branch))
+        else:
+            return _ANY_CHAR
+    return chars
+
+
+def _required_chars(items):
+    """Return a list of character sets which every match of a parsed regex
+    must consume one of.
+    
+    """
+    required = []
+    for op, av in items:
+        single = _single_chars(op, av)
+        if single is not None:
+            required.append(single)
+        elif op in _REPEATS and av[0]:
+            required.extend(_required_chars(av[2]))
+        elif op == sre_constants.SUBPATTERN:
+            required.extend(_required_chars(av[-1]))
+    return required
+
+
+def _flatten(items):
+    out = []
+    for op, av in items:
+        if op == sre_constants.SUBPATTERN:
+            out.extend(_flatten(av[-1]))
+        elif op not in _ZERO_WIDTH:
+            out.append((op, av))
+    return out
+
+
+def _compare(a, b):
+    """Compare the languages of two alternatives.
+    
+    Returns None if no match of one may be a prefix of a match of the other,
+    True if they may match the same string, or otherwise the set of
+    characters which may follow where the shorter match ends.
+    
+    """
+    a = _flatten(a)
+    b = _flatten(b)
+    for i in xrange(min(len(a), len(b)) + 1):
+        if i == len(a) or i == len(b):
+            chars, nullable = _first_chars((b if i == len(a) else a)[i:])
+            return True if nullable else chars
+        x = _single_chars(*a[i])
+        y = _single_chars(*b[i])
+        if x is None or y is None:
+            # Past what we can line up one character at a time.
+            x, x_nullable = _first_chars(a[i:])
+            y, y_nullable = _first_chars(b[i:])
+            if x_nullable or y_nullable or _overlaps(x, y):
+                return True
+            return
+        if not _overlaps(x, y):
+            return
+
+
+def _item_continuations(op, av):
+    if op in _REPEATS:
+        body = av[2]
+        inner = _continuations(body)
+        chars = inner
+        if av[1] > av[0]:
+            chars = _union(chars, _first_chars(body)[0])
+        if av[1] > 1 and _overlaps(inner, _first_chars(body)[0]):
+            chars = _union(chars, _all_chars(body))
+        return chars
+    if op == sre_constants.SUBPATTERN:
+        return _continuations(av[-1])
+    if op == sre_constants.BRANCH:
+        chars = _NO_CHARS
+        branches = av[1]
+        for i, a in enumerate(branches):
+            chars = _union(chars, _continuations(a))
+            for b in branches[i + 1:]:
+                res = _compare(a, b)
+                if res is True:
+                    chars = _union(chars, _union(_all_chars(a), _all_chars(b)))
+                elif res is not None:
+                    chars = _union(chars, res)
+        return chars
+    if op in _ZERO_WIDTH or _single_chars(op, av) is not None:
+        return _NO_CHARS
+    return _ANY_CHAR
+
+
+def _continuations(items):
+    """Return the set of characters with which a complete match of a parsed
+    regex may carry on into a longer one; ie. where the longer one differs.
+    
+    """
+    items = [x for x in items if x[0] not in _ZERO_WIDTH]
+    chars = _NO_CHARS
+    for i, (op, av) in enumerate(items):
+        cont = _item_continuations(op, av)
+        rest = items[i + 1:]
+        rest_chars, rest_nullable = _first_chars(rest)
+        if rest_nullable:
+            chars = _union(chars, _union(cont, rest_chars))
+        elif _overlaps(cont, rest_chars):
+            # It may take what the rest started with, and the rest carry on
+            # from there.
+            chars = _union(chars, _all_chars(rest))
+    return chars
+
+
+def _has_repeat(items):
+    for op, av in items:
+        if op in _REPEATS and av[1] > av[0]:
+            return True
+        if op == sre_constants.SUBPATTERN and _has_repeat(av[-1]):
+            return True
+        if op == sre_constants.BRANCH and any(_has_repeat(x) for x in av[1]):
+            return True
+    return False
+
+
+def _check_regex(items, problems, repeated=False):
+    # `repeated` is if we are within an unbounded repeat.
+    previous = None
+    for op, av in items:
+        repeat = None
+        if op in _REPEATS and av[1] == _MAXREPEAT:
+            repeat = av
+        elif op == sre_constants.SUBPATTERN:
+            body = av[-1]
+            if len(body) == 1 and body[0][0] in _REPEATS and body[0][1][1] == _MAXREPEAT:
+                # A group of just a repeat (like every `{name}`) still
+                # abuts its neighbours.
+                repeat = body[0][1]
+        if repeat is not None:
+            body = repeat[2]
+            firsts = _first_chars(body)[0]
+            # An iteration which may end or carry on with what could also
+            # start the next one can split the input many ways.
+            if _overlaps(_continuations(body), firsts):
+                if _has_repeat(body):
+                    problems.append('nested quantifiers may backtrack exponentially')
+                else:
+                    problems.append('overlapping alternatives within a quantifier may backtrack exponentially')
+            # The previous repeat may give up iterations to this one, if they
+            # could be matched by this one.
+            if previous is not None and _overlaps(_first_chars(previous)[0], firsts):
+                chars = _all_chars(body)
+                if all(_overlaps(x, chars) for x in _required_chars(previous)):
+                    problems.append('adjacent quantifiers may backtrack polynomially')
+            _check_regex(body, problems, True)
+            previous = body
+            continue
+        if op in _REPEATS:
+            _check_regex(av[2], problems, repeated)
+        elif op == sre_constants.SUBPATTERN:
+            _check_regex(av[-1], problems, repeated)
+        elif op == sre_constants.BRANCH:
+            if repeated:
+                branches = av[1]
+                if any(_compare(a, b) is True for i, a in enumerate(branches)
+                        for b in branches[i + 1:]):
+                    problems.append('overlapping alternatives within a quantifier may backtrack exponentially')
+            for branch in av[1]:
+                _check_regex(branch, problems, repeated)
+        elif op in _ZERO_WIDTH:
+            continue
+        previous = None
+
+
+def check_regex(regex):
+    """Return a list of reasons that the given regex may backtrack badly (ie.
+    a ReDoS risk) when matched against hostile input; empty if it looks safe.
+    
+    Reasons mentioning "exponentially" are the dangerous ones; see
+    `PatternInterface.strict`.
+    
+    This is a conservative heuristic: it flags unbounded quantifiers whose
+    iterations may split the input more than one way (eg. nested quantifiers,
+    or alternatives where one may match a prefix of another), alternatives
+    within one which may match the same string, and adjacent ones which may
+    trade iterations.
+    
+    """
+    problems = []
+    _check_regex(sre_parse.parse(regex), problems)
+    return sorted(set(problems))
+
+
+def _vet_regex(owner, regex, strict):
+    """Log (or in strict mode, raise for) any dangerous parts of a regex."""
+    problems = check_regex(regex)
+    for problem in problems:
+        if strict and 'exponentially' in problem:
+            raise UnsafePatternError('%r in %r: %s' % (regex, owner, problem))
+        log.warning('%r in %r: %s' % (regex, owner, problem))
+    return problems
+
+
 class PatternInterface(object):
     __metaclass__ = abc.ABCMeta
     
+    # If set (or given `_defer_parsers=True`), nitrogen-style parsers do not
+    # run while searching for a route, but once on the chosen route; see
+    # `parse` and `gating`.
+    defer_parsers = False
+    
+    # If set (or given `_strict=True`), regexes which `check_regex` finds may
+    # backtrack exponentially raise an UnsafePatternError instead of just
+    # logging a warning.
+    strict = False
+    
     @abc.abstractmethod
     def _match(self, path):
         '''Return (data, unmatched_path) if matches, else None.'''
         return None
     
+    def _convert(self, data):
+        '''Return the data from `_match` as native values, or None if they
+        cannot be; run after any requirements are checked on the raw data.
+        
+        '''
+        return data
+    
     @abc.abstractmethod
     def identifiable(self):
         '''Return True if this pattern is able to be specified by a data dict.
@@ -157,6 +586,10 @@ class PatternInterface(object):
         
         '''
         return False 
+    
+    def required_keys(self):
+        '''Return the set of keys which must be supplied to `format`.'''
+        return frozenset()
         
     @abc.abstractmethod
     def _format(self, data):
@@ -169,30 +602,52 @@ class PatternInterface(object):
         self.constants.update(kwargs.pop('constants', {}))
         
         self.defaults = kwargs.pop('defaults', {})
+        self.strict = kwargs.pop('_strict', self.strict)
         
         self.predicates = []
         
-        # Build predicates for nitrogen-style requirements.
+        # Build predicates for nitrogen-style requirements. They check the
+        # captured strings, before any converters turn them into native values.
+        self.requirements = []
         nitrogen_requirements = kwargs.pop('_requirements', {})
         if nitrogen_requirements:
             def make_requirement_predicate(name, regex):
                 req_re = re.compile(regex + '$')
                 def predicate(data):
-                    return name in data and req_re.match(data[name])
+                    if name not in data:
+                        return False
+                    value = data[name]
+                    if not isinstance(value, basestring):
+                        # Defaults and constants may be native values.
+                        value = str(value)
+                    return req_re.match(value)
                 return predicate
             for name, regex in nitrogen_requirements.iteritems():
-                self.predicates.append(make_requirement_predicate(name, regex))
+                _vet_regex(name, regex, self.strict)
+                self.requirements.append(make_requirement_predicate(name, regex))
         
-        # Build predicates for nitrogen-style parsers.
+        # Build predicates for nitrogen-style parsers, or hold onto them to run
+        # once the route has been decided.
+        self.parsers = []
+        defer_parsers = kwargs.pop('_defer_parsers', self.defer_parsers)
         nitrogen_parsers = kwargs.pop('_parsers', {})
         if nitrogen_parsers:
             def make_parser_predicate(name, func):
+                gates_match = getattr(func, 'gates_match', False)
                 def predicate(data):
-                    data[name] = func(data[name])
+                    try:
+                        data[name] = func(data[name])
+                    except ValueError:
+                        if gates_match:
+                            return False
+                        raise
                     return True
                 return predicate
             for name, func in nitrogen_parsers.iteritems():
-                self.predicates.append(make_parser_predicate(name, func))
+                if defer_parsers and not getattr(func, 'gates_match', False):
+                    self.parsers.append((name, func))
+                else:
+                    self.predicates.append(make_parser_predicate(name, func))
         
         self.predicates.extend(kwargs.pop('predicates', []))
         
@@ -205,7 +660,9 @@ class PatternInterface(object):
                     format = func
                     func = lambda value: format % value
                 def formatter(data):
-                    data[name] = func(data[name])
+                    # Missing keys are left for `_format` to complain about.
+                    if name in data:
+                        data[name] = func(data[name])
                 return formatter
             for name, format in nitrogen_formatters.iteritems():
                 self.formatters.append(make_bc_formatter(name, format))
@@ -214,6 +671,17 @@ class PatternInterface(object):
         
         super(PatternInterface, self).__init__(*args)
         
+    def parse(self, data):
+        """Run any deferred parsers on data from `match`, in place.
+        
+        Exceptions are not caught; a parser which may fail should be
+        marked with `gating`.
+        
+        """
+        for name, func in self.parsers:
+            if name in data:
+                data[name] = func(data[name])
+    
     def _test_predicates(self, data):
         for func in self.predicates:
             if not func(data):
@@ -233,6 +701,15 @@ class PatternInterface(object):
         
         result = self.defaults.copy()
         result.update(self.constants)
+        if self.requirements:
+            raw = result.copy()
+            raw.update(data)
+            for func in self.requirements:
+                if not func(raw):
+                    return
+        data = self._convert(data)
+        if data is None:
+            return
         result.update(data)
 
         if not self._test_predicates(result):
@@ -271,6 +748,7 @@ class PatternInterface(object):
         m, d = x
         if d:
             raise FormatIncompleteMatchError('final result was not fully captured by original pattern')
+        self.parse(m)
 
         # Untested.
         if not self._test_predicates(data):
@@ -287,9 +765,100 @@ class PatternInterface(object):
                
     
     
+class _MemoizedIterator(object):
+    
+    """Wraps an iterator so that it may be iterated over many times (even
+    in an interleaved manner) while only running the original once.
+    
+    """
+    
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._items = []
+        self._running = False
+        self._done = False
+    
+    def __iter__(self):
+        i = 0
+        while True:
+            if i < len(self._items):
+                yield self._items[i]
+                i += 1
+                continue
+            if self._done:
+                return
+            if self._running:
+                # We are being asked for more from within ourselves.
+                raise GraphCycleError('cycle in routing graph')
+            self._running = True
+            try:
+                self._items.append(next(self._iterator))
+            except StopIteration:
+                self._done = True
+            finally:
+                self._running = False
+
+
+def _parse_steps(steps):
+    """Run the deferred parsers of the chosen route."""
+    for step in steps:
+        if getattr(step.pattern, 'parsers', None):
+            step.pattern.parse(step.data)
+
+
+def join_generated(steps):
+    """Return the URL for a candidate list of (GenerateStep, GenerateStepMeta),
+    or None if it must be rejected as ambiguous.
+    
+    """
+    # Any trailing unidentifiable segments must not be ambiguous.
+    for step, meta in reversed(steps):
+        if step.identifiable:
+            break
+        if meta.ambiguous:
+            return
+    else:
+        return
+    # log.debug('generated %r' % steps)
+    return normalize_path('/'.join(step.segment for step, meta in steps))
+
+
+# Generations are never reused, so a cache which saw one knows that the graph
+# has changed if it sees any other; `next` on a count is atomic.
+_generations = itertools.count(1)
+
+
 class RouterInterface(object):
     __metaclass__ = abc.ABCMeta
     
+    # Changed whenever the graph below (and including) this router changes,
+    # so that caches know to revalidate themselves; see `_graph_changed`.
+    graph_generation = 0
+    
+    # Weak references to the routers this one is registered on, by their ids;
+    # see `_add_parent`.
+    _parents = None
+    
+    # An optional cache of route resolutions; see `webstar.sharedcache`.
+    route_cache = None
+    
+    # If set, `wsgi_route` redirects any request which does not match the URL
+    # generated from its own route data to that canonical URL. The verdict for
+    # each path is remembered (up to the given number of paths).
+    canonicalize = False
+    canonical_cache_size = 10000
+    _canonical_cache = None
+    
+    # If set, `wsgi_route` refuses (with a 414) any PATH_INFO longer than this
+    # many characters, or with more than this many (non-empty) segments,
+    # before it is matched against any patterns.
+    max_path_length = None
+    max_path_segments = None
+    
+    # An optional `webstar.shadow.Shadow`, which checks a sample of `route`
+    # and `generate` results against the reference algorithms.
+    shadow = None
+    
     def __repr__(self):
         return '<%s at 0x%x>' % (self.__class__.__name__, id(self))
     
@@ -305,10 +874,76 @@ class RouterInterface(object):
         while False:
             yield None
     
+    def reference_route_step(self, path):
+        """Yield the same as `route_step`, via the plainest search possible;
+        `webstar.shadow` compares optimized searches against this.
+        
+        """
+        return self.route_step(path)
+    
+    def reference_generate_step(self, data):
+        """Yield the same as `generate_step`, via the plainest search possible."""
+        return self.generate_step(data)
+    
     def children(self):
         """Return a list of tuples for each child: (identifiable, pattern, node)"""
         return []
     
+    def generate_children(self):
+        """Return a list of tuples for each child, in the order that
+        `generate_step` considers them: (pattern, node)
+        
+        `url_chains`, `generate_many`, and `footprint` walk the graph with
+        this, so a router which does not provide it cannot be used with them;
+        returning no children would silently hide its subtree instead.
+        
+        """
+        raise TypeError('%r does not provide generate_children' % self)
+    
+    def step_index(self, step):
+        """Return the index of the child which yielded the given RouteStep, or
+        None if this router does not support indexed routing.
+        
+        """
+        return None
+    
+    def route_step_at(self, path, index):
+        """Return the RouteStep for the child at the given index (as returned
+        by `step_index`), or None if it does not match.
+        
+        """
+        return None
+    
+    def _add_parent(self, parent):
+        """Remember that this router is a child of `parent`, so that changes
+        to this router change the generation of the parent as well.
+        
+        Parents are never forgotten (until they are collected); a stale one
+        only costs its caches a spurious revalidation.
+        
+        """
+        if self._parents is None:
+            self._parents = {}
+        self._parents[id(parent)] = weakref.ref(parent)
+    
+    def _graph_changed(self):
+        """Give this router, and every router it may be reached from, a new
+        `graph_generation`."""
+        generation = next(_generations)
+        visited = set()
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
+            node.graph_generation = generation
+            # `values` copies, so parents may be added concurrently.
+            for ref in (node._parents or {}).values():
+                parent = ref()
+                if parent is not None:
+                    pending.append(parent)
+    
     def print_graph(self):
         print self
         self._print_graph(1, set())
@@ -332,31 +967,113 @@ class RouterInterface(object):
     def route(self, path):
         """Route a given path, starting at this router."""    
         path = normalize_path(path)
+        route = self._route_path(path)
+        shadow = self.shadow
+        if shadow is not None and shadow.sample():
+            shadow.check_route(self, path, route)
+        return route
+    
+    def _route_path(self, path):
+        cache = self.route_cache
+        if cache is not None:
+            steps = cache.get(self, path)
+            if steps is not None:
+                _parse_steps(steps)
+                return Route(path, self, steps)
         # log.debug('starting route for %r' % path)
         steps = self._route(self, path, 0)
         # log.debug('done')
         if not steps:
             return
+        if cache is not None:
+            cache.set(self, path, steps)
+        _parse_steps(steps)
         route = Route(path, self, steps)
         return route
     
-    def _route(self, node, path, depth):
+    def route_many(self, paths, chunk_size=10000):
+        """Yield the result of `route` for every path, in order.
+        
+        Paths are taken a chunk at a time (to keep memory bounded), and every
+        route search within a chunk shares its results: duplicate paths are
+        only routed once, and a router reached with exactly the same unrouted
+        path via another input (or another parent) reuses what was found
+        before. Nothing is shared between paths which merely have a prefix in
+        common, so a chunk of unique paths is no faster than calling `route`
+        on each.
+        
+        """
+        paths = iter(paths)
+        while True:
+            chunk = list(itertools.islice(paths, chunk_size))
+            if not chunk:
+                return
+            memo = {}
+            normalized = dict((x, normalize_path(x)) for x in set(chunk))
+            found = {}
+            for path in set(normalized.itervalues()):
+                found[path] = self._route(self, path, 0, memo=memo)
+            for path in chunk:
+                path = normalized[path]
+                steps = found[path]
+                if not steps:
+                    yield None
+                    continue
+                # Every route gets its own data, as it would from `route`.
+                steps = [step._make((step.head, step.consumed, step.unrouted,
+                    step.data.copy(), step.router, step.pattern)) for step in steps]
+                _parse_steps(steps)
+                yield Route(path, self, steps)
+    
+    def _route(self, node, path, depth, stack=None, memo=None):
         if not isinstance(node, RouterInterface):
             # log.debug('%d: found leaf -> %r' % (depth, node))
             return []
+        
+        # A node we are already within, with nothing more consumed, can only
+        # recurse forever. A node we have already tried with this path (via
+        # another parent) will give the same result again.
+        key = (id(node), path)
+        if stack is None:
+            stack = set()
+        if memo is None:
+            memo = {}
+        if key in stack:
+            raise GraphCycleError('cycle to %r with %r unrouted' % (node, path))
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        stack.add(key)
+        
         # log.debug('%d: trying %r with %r' % (depth, path, node))
-        for step in node.route_step(path):
-            res = self._route(step.head, step.unrouted, depth + 1)
-            if res is not None:
-                # log.debug('%d: got %r' % (depth, res))
-                return [step] + res
-            else:
-                pass
-                # log.debug('%d: deadend' % (depth, ))
+        res = None
+        try:
+            for step in node.route_step(path):
+                res = self._route(step.head, step.unrouted, depth + 1, stack, memo)
+                if res is not None:
+                    # log.debug('%d: got %r' % (depth, res))
+                    res = [step] + res
+                    break
+                else:
+                    pass
+                    # log.debug('%d: deadend' % (depth, ))
+        finally:
+            stack.remove(key)
+        memo[key] = res
+        return res
     
     def wsgi_route(self, environ):
         
         path_info = environ.get('PATH_INFO', '')
+        if self.max_path_length is not None and len(path_info) > self.max_path_length:
+            return self.too_long_app
+        if self.max_path_segments is not None and path_info.count('/') > self.max_path_segments:
+            # Only non-empty segments count, so that a trailing (or doubled)
+            # slash is normalized rather than refused.
+            if sum(1 for x in path_info.split('/') if x) > self.max_path_segments:
+                return self.too_long_app
+        
         normalized = normalize_path(path_info)
         if path_info and path_info != normalized:
             return self.make_not_normalized_app(normalized)
@@ -365,6 +1082,11 @@ class RouterInterface(object):
         if route is None:
             return self.not_found_app
         
+        if self.canonicalize:
+            canonical = self._get_canonical(route)
+            if canonical is not None:
+                return self.make_canonical_app(canonical)
+        
         # Build up wsgi.routing_args data
         args, kwargs = environ.setdefault('wsgiorg.routing_args', ((), {}))
         for step in route:
@@ -379,6 +1101,85 @@ class RouterInterface(object):
     def __call__(self, environ, start):
         return self.wsgi_route(environ)(environ, start)
     
+    def _get_canonical(self, route):
+        """Return the canonical path to redirect the route to, or None if it is
+        already canonical (or we cannot tell).
+        
+        """
+        cache = self._canonical_cache
+        if cache is None or cache[0] != self.graph_generation:
+            cache = self._canonical_cache = (self.graph_generation, {})
+        verdicts = cache[1]
+        path = route[0].unrouted
+        try:
+            return verdicts[path]
+        except KeyError:
+            pass
+        canonical = self._find_canonical(route)
+        if len(verdicts) >= self.canonical_cache_size:
+            verdicts.clear()
+        verdicts[path] = canonical
+        return canonical
+    
+    def _find_canonical(self, route):
+        # Keep generating and routing until we find a route which generates
+        # what it consumed, or we can't go any further. Only the consumed part
+        # is ours to canonicalize; whatever is unrouted is carried along as-is.
+        original = path = route[0].unrouted
+        app, data = route.app, route.data
+        seen = set([path])
+        while True:
+            generated = route.url_for(_strict=False)
+            if not generated:
+                log.warning('incomplete definition; could not generate URL for %r' % path)
+                return
+            consumed = route.consumed
+            if generated == consumed:
+                return None if path == original else path
+            if path.startswith(consumed):
+                generated += path[len(consumed):]
+            else:
+                generated += route.unrouted
+            if generated in seen:
+                log.error('canonical URL loop for %r: %r' % (original, sorted(seen)))
+                return
+            seen.add(generated)
+            path = generated
+            route = self.route(path)
+            if route is None:
+                log.warning('incomplete definition; could not route generated %r' % path)
+                return
+            if route.app is not app or route.data != data:
+                # The generated URL is for something else entirely (eg. the
+                # data did not pick out a single endpoint).
+                log.debug('generated %r for %r routes elsewhere' % (path, original))
+                return
+    
+    def make_canonical_app(self, canonical):
+        def _canonical_app(environ, start):
+            location = environ.get('SCRIPT_NAME', '') + canonical
+            if environ.get('QUERY_STRING'):
+                location += '?' + environ['QUERY_STRING']
+            # 307 retains the request method and body.
+            if environ.get('REQUEST_METHOD', 'GET') in ('GET', 'HEAD'):
+                status = '301 Moved Permanently'
+            else:
+                status = '307 Temporary Redirect'
+            log.info('redirecting via %s to canonical %r' % (status[:3], location))
+            start(status, [
+                ('Location', location),
+                ('Content-Type', 'text/html'),
+            ])
+            return ['''
+<html><head> 
+<title>%s</title> 
+</head><body> 
+<h1>Non-canonical URL</h1> 
+<p>Your requested URL (%s) is being redirected to the canonical location (%s).</p> 
+</body></html>
+            '''.strip() % (status, environ.get('PATH_INFO'), location)]
+        return _canonical_app
+    
     def make_not_normalized_app(self, normalized):
         def _not_normalized_app(environ, start):
             path_info = environ.get('PATH_INFO')
@@ -410,65 +1211,321 @@ class RouterInterface(object):
 </body></html>
         '''.strip() % path_info]
         
+    def too_long_app(self, environ, start):
+        log.info('414 for %r' % environ.get('PATH_INFO', '')[:100])
+        start('414 Request-URI Too Long', [('Content-Type', 'text/html')])
+        return ['''
+<html><head> 
+<title>414 Request-URI Too Long</title> 
+</head><body> 
+<h1>Request-URI Too Long</h1> 
+<p>The requested URL is longer than this server will route.</p> 
+</body></html>
+        '''.strip()]
+        
+
     def generate(self, *args, **kwargs):
         data = dict()
         for arg in args:
             data.update(arg)
         data.update(kwargs)
         # log.debug('starting URL generation with %r' % data)
+        url = None
         for steps in self._generate(self, data, 0):
-            
-            # Reject ambiguous paths: any trailing unidentifiable segments
-            # must not be ambiguous.
-            reject = True
-            for step, meta in reversed(steps):
-                if step.identifiable:
-                    reject = False
-                    break
-                if meta.ambiguous:
-                    break
-            if reject:
-                # log.debug('reject ambiguous candidate %r' % [step for step, meta in steps])
-                continue
-            
-            # log.debug('generated %r' % steps)
-            return normalize_path('/'.join(step.segment for step, meta in steps))
+            url = join_generated(steps)
+            if url is not None:
+                break
+        shadow = self.shadow
+        if shadow is not None and shadow.sample():
+            shadow.check_url(self, data, url)
+        return url
 
-    def _generate(self, node, data, depth):
-        data = data.copy()
+    def _generate(self, node, data, depth, memo=None):
         # log.debug('%d: %r' % (depth, node))
         if not isinstance(node, RouterInterface):
             # log.debug('%d: leaf %r' % (depth, node))
             yield []
             return
+        
+        # The data does not change during a single generation, so the results
+        # below a node are the same no matter how we got to it; a subgraph
+        # shared by several parents is only explored once.
+        if memo is None:
+            memo = {}
+            data = data.copy()
+        results = memo.get(id(node))
+        if results is None:
+            results = memo[id(node)] = _MemoizedIterator(
+                self._generate_node(node, data, depth, memo))
+        for steps in results:
+            yield steps
+    
+    def _generate_node(self, node, data, depth, memo):
         steps = list(node.generate_step(data))    
         meta = GenerateStepMeta(ambiguous=len(steps) != 1)
         for step in steps:
             # log.debug('%d: got %r' % (depth, step.segment))
-            for sub_steps in self._generate(step.head, data, depth + 1):
+            for sub_steps in self._generate(step.head, data, depth + 1, memo):
                 yield [(step, meta)] + sub_steps
+    
+    def _reaches(self, target):
+        """Return True if the target node is reachable from this one."""
+        visited = set()
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            if node is target:
+                return True
+            if id(node) in visited:
+                continue
+            visited.add(id(node))
+            for _, _, child in node.children():
+                if isinstance(child, RouterInterface):
+                    pending.append(child)
+        return False
+    
+    def footprint(self):
+        """Return a `webstar.footprint.Footprint`; a report of the memory used
+        by the routing graph below this router.
+        
+        """
+        from .footprint import Footprint
+        return Footprint(self)
+    
+    def check_graph(self):
+        """Raise a GraphCycleError if there are any cycles below this router."""
+        done = set()
+        def walk(node, stack):
+            if id(node) in done:
+                return
+            if id(node) in stack:
+                raise GraphCycleError('cycle to %r' % node)
+            stack.add(id(node))
+            for _, _, child in node.children():
+                if isinstance(child, RouterInterface):
+                    walk(child, stack)
+            stack.remove(id(node))
+            done.add(id(node))
+        walk(self, set())
                 
-    def url_for(self, _strict=True, **data):
+    def url_for(self, _strict=True, _query=None, _fragment=None, **data):
         url = self.generate(data)
         if _strict and not url:
             raise GenerationError('could not generate URL for %r' % data)
+        if url:
+            url = append_query(url, _query, _fragment)
         return url
+    
+    def url_chains(self):
+        """Return a list of URLChain, one for every chain of patterns from this
+        router to a leaf that `generate` could use, in the order it tries them.
+        
+        Walks the graph once; a subgraph shared by several parents is only
+        walked the first time it is found.
+        
+        """
+        suffixes = {}
+        def walk(node, stack):
+            if not isinstance(node, RouterInterface):
+                return [()]
+            if id(node) in suffixes:
+                return suffixes[id(node)]
+            if id(node) in stack:
+                raise GraphCycleError('cycle to %r' % node)
+            stack.add(id(node))
+            out = []
+            for pattern, child in node.generate_children():
+                for suffix in walk(child, stack):
+                    out.append(((node, pattern),) + suffix)
+            stack.remove(id(node))
+            suffixes[id(node)] = out
+            return out
+        chains = [URLChain(steps) for steps in walk(self, set())]
+        return [chain for chain in chains if chain.identifiable]
+    
+    def generate_many(self, rows):
+        """Yield the result of `generate` for each dict in an iterable of rows.
+        
+        The graph is walked once, instead of once per row; memory does not
+        grow with the number of rows. Rows may include `_query` and
+        `_fragment`, as with `url_for`.
+        
+        """
+        chains = self.url_chains()
+        for row in rows:
+            row, query, fragment = _pop_url_args(row)
+            keys = set(row)
+            for chain in chains:
+                if not chain.keys.issubset(keys):
+                    continue
+                url = chain.generate(row)
+                if url is not None:
+                    yield append_query(url, query, fragment)
+                    break
+            else:
+                yield None
+
+
+class URLChain(object):
+    
+    """A chain of patterns from a router to a leaf, which URLs are generated
+    along; see `RouterInterface.url_chains`.
+    
+    Attributes:
+        steps -- A tuple of (router, pattern) for every step of the chain.
+        keys -- The set of keys which rows must supply.
+    
+    """
+    
+    def __init__(self, steps):
+        self.steps = steps
+        self.patterns = tuple(pattern for _, pattern in steps)
+        self.keys = frozenset().union(*[pattern.required_keys() for pattern in self.patterns])
+        
+        # Like `generate`, we must check that any trailing unidentifiable
+        # steps are not ambiguous; find the routers which would need checking.
+        self.identifiable = False
+        self._trailing = []
+        for router, pattern in reversed(steps):
+            if pattern.identifiable():
+                self.identifiable = True
+                break
+            self._trailing.append(router)
+    
+    def __repr__(self):
+        return '<%s:%s>' % (self.__class__.__name__, ''.join(
+            getattr(pattern, '_raw', None) or '*' for pattern in self.patterns))
+    
+    def generate(self, data):
+        """Return the URL for the given data along this chain, or None."""
+        try:
+            segments = [pattern.format(**data) for pattern in self.patterns]
+        except FormatError:
+            return
+        for router in self._trailing:
+            if sum(1 for _ in router.generate_step(data)) != 1:
+                return
+        return normalize_path('/'.join(segments))
+    
+    def generate_many(self, rows):
+        """Yield the URL (or None) for each dict in an iterable of rows.
+        
+        Rows may include `_query` and `_fragment`, as with `url_for`.
+        
+        """
+        for row in rows:
+            row, query, fragment = _pop_url_args(row)
+            url = self.generate(row)
+            yield url and append_query(url, query, fragment)
+
+
+def _iter_route_attr_sources(step):
+    """Yield the objects (other than the route data) which may carry route
+    attributes for the given step, in the order they are checked.
+    
+    """
+    # The router or final app.
+    yield step.head
+    # In attribute on the module if from register_module.
+    module = step.data.get('__module__', None)
+    if module:
+        yield module
+        # And finally packages.
+        pkg_name = module.__package__
+        if pkg_name and pkg_name != module.__name__:
+            yield sys.modules[pkg_name]
 
 
 def get_route_attr_list(route, name):
-    values = []
+    return get_route_attr_lists(route, [name])[name]
+
+
+def get_route_attr_lists(route, names):
+    """Like `get_route_attr_list`, but for several names in one walk.
+    
+    Returns a dict mapping each name to its list of values.
+    
+    """
+    out = dict((name, []) for name in names)
     for step in reversed(route):
-        # The router or final app.
-        values.extend(getattr(step.head, name, []))
-        # In the route data.
-        values.extend(step.data.get(name, []))
-        # In attribute on the module if from register_module.
-        module = step.data.get('__module__', None)
-        if module:
-            values.extend(getattr(module, name, []))
-            # And finally packages.
-            pkg_name = module.__package__
-            if pkg_name and pkg_name != module.__name__:
-                values.extend(getattr(sys.modules[pkg_name], name, []))
-    return values
+        sources = list(_iter_route_attr_sources(step))
+        for name, values in out.iteritems():
+            values.extend(getattr(sources[0], name, []))
+            values.extend(step.data.get(name, []))
+            for source in sources[1:]:
+                values.extend(getattr(source, name, []))
+    return out
+
+
+class RouteAttrResolver(object):
+    
+    """A caching version of `get_route_attr_list`.
+    
+    The attributes of the heads, modules and packages along a route are
+    cached by the identity of those objects and the attribute name, so they
+    must be explicitly invalidated if they change. Values from the route data
+    are always looked up fresh.
+    
+    """
+    
+    def __init__(self):
+        self._cache = {}
+    
+    def _static(self, names, steps, sources, key):
+        """Return a dict mapping each name to a list of (head_values,
+        module_values) for each step; uncached names are found in one walk.
+        
+        """
+        out = {}
+        missing = []
+        for name in names:
+            try:
+                out[name] = self._cache[(name, key)][1]
+            except KeyError:
+                missing.append(name)
+        if not missing:
+            return out
+        static = dict((name, []) for name in missing)
+        for step_sources in sources:
+            for name in missing:
+                head_values = tuple(getattr(step_sources[0], name, []))
+                module_values = []
+                for source in step_sources[1:]:
+                    module_values.extend(getattr(source, name, []))
+                static[name].append((head_values, tuple(module_values)))
+        for name in missing:
+            # We hold onto the sources so that their ids are not reused.
+            self._cache[(name, key)] = (sources, static[name])
+        out.update(static)
+        return out
+    
+    def get(self, route, name):
+        return self.get_many(route, [name])[name]
+    
+    def get_many(self, route, names):
+        """Return a dict mapping each name to its list of values."""
+        steps = list(reversed(route))
+        sources = tuple(tuple(_iter_route_attr_sources(step)) for step in steps)
+        key = tuple(tuple(id(source) for source in step_sources) for step_sources in sources)
+        static = self._static(names, steps, sources, key)
+        out = {}
+        for name in names:
+            values = out[name] = []
+            for step, (head_values, module_values) in zip(steps, static[name]):
+                values.extend(head_values)
+                values.extend(step.data.get(name, []))
+                values.extend(module_values)
+        return out
+    
+    def invalidate(self, obj=None):
+        """Forget cached attributes of any route passing through the given
+        head, module or package, or everything if not given.
+        
+        """
+        if obj is None:
+            self._cache.clear()
+            return
+        for key, (sources, _) in self._cache.items():
+            if any(source is obj for step_sources in sources for source in step_sources):
+                self._cache.pop(key, None)
     
@@ -0,0 +1,104 @@
+"""Counters which threads update without contending with each other.
+
+Each thread increments a shard of its own, and the shards are only summed when
+the total is read; the only lock is taken once per thread, on its first
+increment, when the total is read, and when the thread ends. Totals read while
+other threads are counting may be a few counts behind, but increments are
+never lost.
+
+When a thread ends its shard is folded into a shared one, so servers which
+start a thread per request do not accumulate a shard for every request.
+
+"""
+
+import threading
+import weakref
+
+
+class _Token(object):
+    # Held only by a thread's locals, so that we know when they are gone.
+    __slots__ = ('__weakref__', )
+
+
+class ThreadShards(object):
+
+    """Per-thread shards of some state, which are folded into a shared one
+    when their thread ends.
+
+    Params:
+        make -- Returns a new, empty shard.
+        fold -- Called with (into, shard) to add one shard into another.
+
+    """
+
+    def __init__(self, make, fold):
+        self._make = make
+        self._fold = fold
+        self._local = threading.local()
+        # Weakrefs to each live thread's token, to that thread's shard.
+        self._live = {}
+        # Reentrant in case a token is collected while we hold it.
+        self._lock = threading.RLock()
+        self._retired = make()
+
+    def get(self):
+        """Return the calling thread's shard."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            return self._add()
+
+    def _add(self):
+        shard = self._make()
+        token = _Token()
+        with self._lock:
+            self._live[weakref.ref(token, self._retire)] = shard
+        self._local.shard = shard
+        self._local.token = token
+        return shard
+
+    def _retire(self, ref):
+        with self._lock:
+            shard = self._live.pop(ref, None)
+            if shard is not None:
+                self._fold(self._retired, shard)
+
+    def fold_into(self, into):
+        """Fold every shard, live or retired, into the given one."""
+        with self._lock:
+            self._fold(into, self._retired)
+            for shard in self._live.values():
+                self._fold(into, shard)
+        return into
+
+    def __len__(self):
+        """The number of live shards."""
+        return len(self._live)
+
+
+def _fold_count(into, shard):
+    into[0] += shard[0]
+
+
+class ThreadCounter(object):
+
+    def __init__(self):
+        self._shards = ThreadShards(lambda: [0], _fold_count)
+
+    def add(self, amount=1):
+        self._shards.get()[0] += amount
+
+    @property
+    def value(self):
+        return self._shards.fold_into([0])[0]
+
+    def __int__(self):
+        return self.value
+
+    def __repr__(self):
+        return '<%s:%d>' % (self.__class__.__name__, self.value)
+
+
+def counter_property(name, doc=None):
+    """A read-only property of the total of the ThreadCounter at `name`."""
+    return property(lambda self: getattr(self, name).value, doc=doc)
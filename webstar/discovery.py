@@ -0,0 +1,160 @@
+"""Discovery of the modules within a package's directories, for
+`Router.register_package`.
+
+Each directory is listed once. Where `scandir` is available (Python 3.5+, or
+the `scandir` backport) the type of every entry comes with the listing, so
+only directories cost an extra stat (to look for an `__init__`).
+
+A `DiscoveryIndex` can also persist the results between runs, keyed by the
+mtimes of the directories involved, so that an unchanged tree costs one stat
+per directory instead of a listing.
+
+"""
+
+import cPickle as pickle
+import errno
+import logging
+import os
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+log = logging.getLogger(__name__)
+
+
+def _iter_entries(directory):
+    """Yield (name, is_dir) for every entry in a directory."""
+    if scandir is not None:
+        for entry in scandir(directory):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            yield entry.name, is_dir
+    else:
+        for name in os.listdir(directory):
+            # Names with a dot can't be packages, so don't stat them (which
+            # is most of them; the .py and .pyc files).
+            if '.' in name:
+                yield name, False
+            else:
+                yield name, os.path.isdir(os.path.join(directory, name))
+
+
+def _is_package(path):
+    init_path = os.path.join(path, '__init__.py')
+    return os.path.exists(init_path) or os.path.exists(init_path + 'c')
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def scan_directory(directory):
+    """Return (module_names, subdirectories) for a directory.
+
+    The subdirectories are those which were checked for being packages, as
+    their mtimes determine if the result is still valid.
+
+    """
+    names = set()
+    subdirectories = []
+    for name, is_dir in _iter_entries(directory):
+        if is_dir:
+            subdirectories.append(name)
+            if _is_package(os.path.join(directory, name)):
+                names.add(name)
+                continue
+        if not (name.endswith('.py') or name.endswith('.pyc')):
+            continue
+        name = name.rsplit('.', 1)[0]
+        if name == '__init__':
+            continue
+        names.add(name)
+    return names, subdirectories
+
+
+def find_module_names(directory, index=None):
+    """Return the set of names of modules and packages in a directory.
+
+    Params:
+        directory -- The directory to look in; missing directories are empty.
+        index -- An optional DiscoveryIndex to consult and update.
+
+    """
+    if index is not None:
+        names = index.get(directory)
+        if names is not None:
+            return names
+    mtime = _mtime(directory)
+    if mtime is None:
+        return set()
+    names, subdirectories = scan_directory(directory)
+    if index is not None:
+        index.set(directory, mtime, names, dict(
+            (name, _mtime(os.path.join(directory, name))) for name in subdirectories))
+    return names
+
+
+class DiscoveryIndex(object):
+
+    """A persistent record of the modules found in directories.
+
+    An entry is valid as long as the mtimes of its directory, and of the
+    subdirectories within it, have not changed.
+
+        >>> index = DiscoveryIndex('/tmp/myapp.discovery')
+        >>> router.register_package(None, 'myapp.views', recursive=True,
+        ...     discovery_index=index)
+        >>> index.save()
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        self._entries = {}
+        try:
+            with open(path, 'rb') as fh:
+                self._entries = pickle.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except Exception as e:
+            log.warning('could not load discovery index %r: %r' % (path, e))
+
+    def get(self, directory):
+        """Return the set of names for a directory if they are still valid."""
+        entry = self._entries.get(directory)
+        if entry is None:
+            return
+        mtime, names, subdirectories = entry
+        if _mtime(directory) != mtime:
+            return
+        for name, sub_mtime in subdirectories.iteritems():
+            if _mtime(os.path.join(directory, name)) != sub_mtime:
+                return
+        return set(names)
+
+    def set(self, directory, mtime, names, subdirectories):
+        self._entries[directory] = (mtime, sorted(names), subdirectories)
+        self.dirty = True
+
+    def save(self):
+        """Write the index out, if it has changed."""
+        if not self.dirty:
+            return
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(self._entries, fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path)
+        self.dirty = False
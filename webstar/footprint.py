@@ -0,0 +1,212 @@
+"""Memory accounting for routing graphs.
+
+    >>> print root.footprint().format()
+
+Sizes are deep (via `sys.getsizeof`), and every object is counted once, by
+the first router or pattern it is found under, so the parts add up to the
+total. Modules, classes, and the leaf apps are not counted, nor are the
+globals of functions.
+
+Identical containers held by many patterns or routers (eg. an empty
+`defaults` dict on every pattern) are reported as duplicates which could be
+shared.
+
+"""
+
+import collections
+import sys
+import types
+
+from . import core
+
+
+_not_counted = (type, types.ClassType, types.ModuleType, types.CodeType)
+
+
+def deep_size(obj, seen=None, stop=()):
+    """Return the size in bytes of an object and all it refers to.
+
+    Params:
+        seen -- A set of ids of objects which have already been counted, and
+            which is updated with those counted now.
+        stop -- A set of ids of objects which should not be counted at all.
+
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or id(obj) in stop or isinstance(obj, _not_counted):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.iterkeys())
+            pending.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            pending.extend(obj)
+        elif isinstance(obj, types.FunctionType):
+            pending.extend(cell.cell_contents for cell in obj.func_closure or ()
+                if _cell_has_contents(cell))
+            pending.append(obj.func_defaults)
+            pending.append(obj.func_dict)
+        elif isinstance(obj, types.MethodType):
+            pending.append(obj.im_self)
+            pending.append(obj.im_func)
+        else:
+            pending.append(getattr(obj, '__dict__', None))
+            for cls in type(obj).__mro__:
+                slots = cls.__dict__.get('__slots__', ())
+                if isinstance(slots, basestring):
+                    slots = (slots, )
+                for name in slots:
+                    pending.append(getattr(obj, name, None))
+    return size
+
+
+def _cell_has_contents(cell):
+    try:
+        cell.cell_contents
+    except ValueError:
+        return False
+    return True
+
+
+def _freeze(value):
+    """Return a hashable equivalent of a container, or None."""
+    try:
+        if isinstance(value, dict):
+            return frozenset(value.iteritems())
+        return tuple(value)
+    except TypeError:
+        return
+
+
+class Footprint(object):
+
+    """A report of the memory used by a routing graph.
+
+    Attributes:
+        total -- The size of the whole graph, in bytes.
+        routers -- A list of (label, router, own_size, subtree_size) for every
+            router; its own size includes its patterns, and the subtree
+            includes every router reachable from it.
+        patterns -- A list of (label, pattern, size) for every pattern.
+        duplicates -- A list of (description, copies, wasted_size) for equal
+            containers held separately by patterns or routers.
+
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.routers = []
+        self.patterns = []
+        self.duplicates = []
+        self._measure()
+
+    def _measure(self):
+
+        # Find every node first, so that measuring one never counts another.
+        order = []
+        labels = {}
+        edges = {}
+        stop = set()
+        pending = [(self.root, '')]
+        while pending:
+            node, label = pending.pop()
+            if id(node) in labels:
+                continue
+            labels[id(node)] = label
+            order.append(node)
+            edges[id(node)] = children = []
+            for pattern, child in reversed(node.generate_children()):
+                stop.add(id(child))
+                if isinstance(child, core.RouterInterface):
+                    children.append(child)
+                    pending.append((child, label + (getattr(pattern, '_raw', None) or '*')))
+            children.reverse()
+
+        seen = set()
+        own = {}
+        containers = collections.defaultdict(dict)
+        for node in order:
+            label = labels[id(node)] or '/'
+            size = 0
+            for pattern, child in node.generate_children():
+                if id(pattern) in seen:
+                    continue
+                pattern_size = deep_size(pattern, seen, stop)
+                size += pattern_size
+                self.patterns.append((label + ' ' + (getattr(pattern, '_raw', None) or '*'),
+                    pattern, pattern_size))
+                self._find_containers(pattern, containers)
+            stop.discard(id(node))
+            own[id(node)] = size + deep_size(node, seen, stop)
+            stop.add(id(node))
+            self._find_containers(node, containers)
+
+        for node in order:
+            reachable = set()
+            pending = [node]
+            while pending:
+                x = pending.pop()
+                if id(x) not in reachable:
+                    reachable.add(id(x))
+                    pending.extend(edges[id(x)])
+            self.routers.append((labels[id(node)] or '/', node, own[id(node)],
+                sum(own[x] for x in reachable)))
+
+        self.total = sum(own.itervalues())
+
+        for (cls_name, name, _), copies in containers.iteritems():
+            if len(copies) < 2:
+                continue
+            example = next(copies.itervalues())
+            wasted = sum(sys.getsizeof(x) for x in copies.itervalues()) - sys.getsizeof(example)
+            description = '%s.%s: %d copies of %s' % (cls_name, name, len(copies),
+                _short_repr(example))
+            self.duplicates.append((description, len(copies), wasted))
+        self.duplicates.sort(key=lambda x: -x[2])
+
+    def _find_containers(self, obj, containers):
+        for name, value in getattr(obj, '__dict__', {}).iteritems():
+            if type(value) not in (dict, list, set):
+                continue
+            frozen = _freeze(value)
+            if frozen is None:
+                continue
+            key = (obj.__class__.__name__, name, (type(value), frozen))
+            try:
+                containers[key][id(value)] = value
+            except TypeError:
+                # The contents were not hashable after all.
+                pass
+
+    def format(self, limit=10):
+        """Return the report as text, with the `limit` largest of each kind."""
+        lines = ['total: %s' % _format_size(self.total)]
+        lines.append('largest subtrees:')
+        for label, router, own, subtree in sorted(self.routers, key=lambda x: -x[3])[:limit]:
+            lines.append('  %10s (%s own) %s' % (_format_size(subtree), _format_size(own), label))
+        lines.append('largest patterns:')
+        for label, pattern, size in sorted(self.patterns, key=lambda x: -x[2])[:limit]:
+            lines.append('  %10s %s' % (_format_size(size), label))
+        if self.duplicates:
+            lines.append('duplicates which could be shared:')
+            for description, copies, wasted in self.duplicates[:limit]:
+                lines.append('  %10s %s' % (_format_size(wasted), description))
+        return '\n'.join(lines)
+
+
+def _short_repr(value, max_length=40):
+    out = repr(value)
+    return out if len(out) <= max_length else out[:max_length - 3] + '...'
+
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return ('%d%s' if unit == 'B' else '%.1f%s') % (size, unit)
+        size /= 1024.0
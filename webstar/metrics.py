@@ -0,0 +1,261 @@
+"""Per-route latency metrics.
+
+    >>> metrics = RouteMetrics(root)
+    >>> root.register('/_metrics', metrics.export_app)
+    >>> application = metrics # Serve this instead of the root.
+
+Requests are labelled by the chain of pattern templates which routed them (eg.
+"/blog/archive/{year:int}/{month:int}"), not by their concrete URLs, and the
+time spent routing is recorded separately from the time spent in the app
+(including iterating its response).
+
+Histograms are bucketed log-linearly, so memory is fixed per label no matter
+how many requests are recorded, and percentiles are accurate to within a few
+percent.
+
+Every thread records into histograms of its own, which are merged only when a
+snapshot is taken (or the thread ends), so requests never wait on each other to
+be recorded.
+
+"""
+
+import bisect
+import operator
+import time
+
+from . import core
+from .counters import ThreadShards
+
+
+# Sub-buckets per doubling; percentiles are within 2 ** (1 / 4) of the truth.
+_SUB_BUCKETS = 4
+# From 1us up to about 2 ** 40us (ie. 12 days).
+_NUM_BUCKETS = 41 * _SUB_BUCKETS
+# The lower bound of every bucket but the first, in seconds; the bucket for a
+# value is the number of these which are not above it.
+_BOUNDS = [(2 ** (i // _SUB_BUCKETS)) * (1 + float(i % _SUB_BUCKETS) / _SUB_BUCKETS) / 1e6
+    for i in xrange(1, _NUM_BUCKETS)]
+_bisect = bisect.bisect_right
+
+NOT_FOUND_LABEL = '<unrouted>'
+
+_get_pattern = operator.attrgetter('pattern')
+
+
+class Histogram(object):
+
+    """A fixed-size histogram of durations, in seconds."""
+
+    def __init__(self):
+        self.counts = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _bucket(value):
+        return _bisect(_BOUNDS, value)
+
+    @staticmethod
+    def _bucket_max(index):
+        exponent, sub = divmod(index, _SUB_BUCKETS)
+        return (2 ** exponent) * (1 + float(sub + 1) / _SUB_BUCKETS) / 1e6
+
+    def add(self, value):
+        self.counts[_bisect(_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Return an upper bound for the given percentile, in seconds."""
+        if not self.count:
+            return 0.0
+        target = self.count * percent / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(self._bucket_max(i), self.max)
+        return self.max
+
+
+def _merge_histograms(into, shard):
+    for label, (route_hist, app_hist) in shard.items():
+        histograms = into.get(label)
+        if histograms is None:
+            histograms = into[label] = (Histogram(), Histogram())
+        histograms[0].merge(route_hist)
+        histograms[1].merge(app_hist)
+
+
+class RouteMetrics(object):
+
+    """WSGI middleware which records per-route timings for a router.
+
+    Params:
+        router -- The RouterInterface to route with.
+        timer -- The function to take times with.
+
+    """
+
+    # The number of labels to remember, by the chain of patterns they are
+    # for, before starting over; only routes through patterns which can be
+    # reached by more than one chain need them.
+    label_cache_size = 1000
+
+    def __init__(self, router, timer=time.time):
+        self.router = router
+        self.timer = timer
+        self._labels = {}
+        # (graph_generation, {pattern: label}) for patterns with only one.
+        self._leaf_labels = (None, {})
+        # Dicts mapping labels to (route, app) Histograms for every thread.
+        self._shards = ThreadShards(dict, _merge_histograms)
+
+    def _walk_labels(self):
+        """Return a dict mapping every pattern in the graph to its label, or
+        to None if there is more than one chain of patterns to it."""
+        labels = {}
+        def walk(node, prefix, stack):
+            try:
+                children = node.generate_children()
+            except TypeError:
+                # Its routes are labelled by their whole chain instead.
+                return
+            stack.add(id(node))
+            for pattern, child in children:
+                label = prefix + (getattr(pattern, '_raw', None) or '')
+                labels[pattern] = label if labels.get(pattern, label) == label else None
+                if isinstance(child, core.RouterInterface) and id(child) not in stack:
+                    walk(child, label, stack)
+            stack.remove(id(node))
+        walk(self.router, '', set())
+        return labels
+
+    def label(self, route):
+        """Return the label for a Route; the templates of its patterns."""
+        
+        # Most patterns are only reached by one chain, so are enough to look
+        # the label up by themselves.
+        generation, labels = self._leaf_labels
+        if generation != self.router.graph_generation:
+            generation = self.router.graph_generation
+            labels = self._walk_labels()
+            self._leaf_labels = (generation, labels)
+        label = labels.get(route[-1].pattern)
+        if label is not None:
+            return label
+        
+        # Keyed by the patterns themselves rather than their ids, so that
+        # they are not collected (and their ids reused) while cached.
+        key = tuple(map(_get_pattern, route))
+        labels = self._labels
+        try:
+            return labels[key]
+        except KeyError:
+            pass
+        label = ''.join(getattr(pattern, '_raw', None) or '' for pattern in key)
+        if len(labels) >= self.label_cache_size:
+            labels.clear()
+        labels[key] = label
+        return label
+
+    def record(self, label, route_time, app_time):
+        shard = self._shards.get()
+        try:
+            route_hist, app_hist = shard[label]
+        except KeyError:
+            route_hist, app_hist = shard[label] = (Histogram(), Histogram())
+        # `Histogram.add`, inlined for both; this is on every request.
+        route_hist.counts[_bisect(_BOUNDS, route_time)] += 1
+        route_hist.count += 1
+        route_hist.total += route_time
+        if route_time > route_hist.max:
+            route_hist.max = route_time
+        app_hist.counts[_bisect(_BOUNDS, app_time)] += 1
+        app_hist.count += 1
+        app_hist.total += app_time
+        if app_time > app_hist.max:
+            app_hist.max = app_time
+
+    def snapshot(self):
+        """Return a dict mapping labels to (route, app) Histograms.
+        
+        Requests being recorded by other threads at the same time may or may
+        not be included.
+        
+        """
+        return self._shards.fold_into({})
+
+    def __call__(self, environ, start):
+        timer = self.timer
+        previous = environ.get(core.HISTORY_ENVIRON_KEY)
+        start_time = timer()
+        app = self.router.wsgi_route(environ)
+        routed_time = timer()
+        route = environ.get(core.HISTORY_ENVIRON_KEY)
+        label = NOT_FOUND_LABEL if route is previous else self.label(route)
+        try:
+            response = app(environ, start)
+        except:
+            self.record(label, routed_time - start_time, timer() - routed_time)
+            raise
+        # A list or tuple is already complete, and has no `close` to wait for.
+        if response.__class__ is list or response.__class__ is tuple:
+            self.record(label, routed_time - start_time, timer() - routed_time)
+            return response
+        return _TimedResponse(self, label, response, start_time, routed_time)
+
+    def export(self, percentiles=(50, 90, 99)):
+        """Return the metrics as text, in Prometheus' exposition format."""
+        lines = []
+        snapshot = sorted(self.snapshot().iteritems())
+        for name, index in (('webstar_route_seconds', 0), ('webstar_app_seconds', 1)):
+            lines.append('# TYPE %s summary' % name)
+            for label, histograms in snapshot:
+                histogram = histograms[index]
+                label = label.replace('\\', '\\\\').replace('"', '\\"')
+                for percent in percentiles:
+                    lines.append('%s{route="%s",quantile="%s"} %.9f' % (
+                        name, label, percent / 100.0, histogram.percentile(percent)))
+                lines.append('%s_sum{route="%s"} %.9f' % (name, label, histogram.total))
+                lines.append('%s_count{route="%s"} %d' % (name, label, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def export_app(self, environ, start):
+        body = self.export()
+        start('200 OK', [('Content-Type', 'text/plain; version=0.0.4')])
+        return [body]
+
+
+class _TimedResponse(object):
+
+    """Wraps a response iterable to record the app time once it is closed."""
+
+    def __init__(self, metrics, label, response, start_time, routed_time):
+        self._metrics = metrics
+        self._label = label
+        self._response = response
+        self._start_time = start_time
+        self._routed_time = routed_time
+
+    def __iter__(self):
+        return iter(self._response)
+
+    def close(self):
+        try:
+            close = getattr(self._response, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._metrics.record(self._label, self._routed_time - self._start_time,
+                self._metrics.timer() - self._routed_time)
@@ -1,14 +1,71 @@
+import datetime
 import hashlib
+import logging
 import re
+import uuid
 
 from . import core
 
 
+log = logging.getLogger(__name__)
+
+
+class Converter(object):
+    
+    """A capture type which can be named in place of a regex; ie. `{id:int}`.
+    
+    Supplies the regex to capture with, a function to parse the captured
+    string into a native value, and a function to format a native value back
+    into the path.
+    
+    """
+    
+    def __init__(self, pattern, parse, format=str):
+        self.pattern = pattern
+        self.parse = parse
+        self.format = format
+    
+    def __repr__(self):
+        return '<%s:r%r>' % (self.__class__.__name__, self.pattern)
+    
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+def _format_date(value):
+    # Not strftime, since it refuses years before 1900.
+    return '%04d-%02d-%02d' % (value.year, value.month, value.day)
+
+
+converters = dict(
+    int=Converter(r'\d+', int, lambda value: '%d' % value),
+    uuid=Converter(r'[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}', uuid.UUID),
+    slug=Converter(r'[a-z0-9]+(?:-[a-z0-9]+)*', str),
+    date=Converter(r'\d{4}-\d{2}-\d{2}', _parse_date, _format_date),
+)
+
+
 class Pattern(core.PatternInterface):
     
     default_pattern = '[^/]+'
     default_format = 's'
     
+    # Names which may be used in place of a regex; ie. `{id:int}`.
+    converters = converters
+    
+    # Share compiled regexes, format strings, and keys between all patterns
+    # with the same raw source; the constants, defaults, predicates, etc. are
+    # still per-instance. See `clear_compile_cache` if you modify any of the
+    # class attributes that the compilation depends upon. Both caches are
+    # cleared when they fill up, so that patterns built on the fly (ie. per
+    # request) do not grow them without bound.
+    intern = True
+    _compile_cache = {}
+    # `core.check_regex` results, by the shape of the regex (see
+    # `_compile_raw`); many patterns differ only in their literal text.
+    _problems_cache = {}
+    _compile_cache_max = 1000
+    
     token_re = re.compile(r'''
         {                            
         ([a-zA-Z_][a-zA-Z0-9_-]*)      # group 1: name
@@ -24,33 +81,94 @@ class Pattern(core.PatternInterface):
     def __init__(self, pattern, **kwargs):
         super(Pattern, self).__init__(**kwargs)
         self._raw = str(pattern or '')
-        self._keys = set()
         self._compile()
 
     def __repr__(self):
         return '<%s:r%s>' % (self.__class__.__name__,
             repr(self._raw).replace('\\\\', '\\'))
 
+    @classmethod
+    def clear_compile_cache(cls):
+        cls._compile_cache.clear()
+        cls._problems_cache.clear()
+    
     def _compile(self):
+        if not self.intern:
+            compiled = self._compile_raw()
+        else:
+            key = (self.__class__, self._raw, self.default_pattern,
+                self.default_format)
+            compiled = self._compile_cache.get(key)
+            if compiled is None:
+                if len(self._compile_cache) >= self._compile_cache_max:
+                    self._compile_cache.clear()
+                compiled = self._compile_cache.setdefault(key, self._compile_raw())
+        self._keys, self._format_string, self._compiled, self._converters, problems = compiled
+        if self.strict:
+            for problem in problems:
+                if 'exponentially' in problem:
+                    raise core.UnsafePatternError('%r: %s' % (self._raw, problem))
+    
+    def _compile_raw(self):
+        """Return (keys, format_string, compiled_re, converters, problems) for
+        the raw pattern; these are safe to share between instances.
+        
+        The problems are those found by `core.check_regex`, and are logged
+        here, once per raw pattern.
+        
+        """
+        
+        self._keys = set()
         self._segments = {}
+        self._converters = []
 
         format = self.token_re.sub(self._compile_sub, self._raw)
         pattern = re.escape(format)
         
+        # The same, but with each run of literal text as a single character;
+        # it only separates the captures, so the checks are the same.
+        shape = ''.join('(?P<%s>%s)' % self._segments[part][:2] if part in self._segments
+            else ('/' if part else '') for part in self._hash_re.split(format))
+
         for hash, (key, patt, form) in self._segments.items():
             pattern = pattern.replace(hash, '(?P<%s>%s)' % (key, patt), 1)
             format  = format.replace(hash, '%%(%s)%s' % (key, form), 1)
 
-        self._format_string = format
-        self._compiled = re.compile(pattern + r'(?=/|$)')
+        pattern += r'(?=/|$)'
+        shape += r'(?=/|$)'
+        problems = self._problems_cache.get(shape)
+        if problems is None:
+            if len(self._problems_cache) >= self._compile_cache_max:
+                self._problems_cache.clear()
+            problems = self._problems_cache.setdefault(shape, tuple(core.check_regex(shape)))
+        for problem in problems:
+            log.warning('%r: %s' % (self._raw, problem))
+
+        compiled = (
+            frozenset(self._keys),
+            format,
+            re.compile(pattern),
+            tuple(self._converters),
+            problems,
+        )
 
         del self._segments
+        return compiled
+
+    _hash_re = re.compile(r'(x[0-9a-f]{32})')
 
     def _compile_sub(self, match):
         name = match.group(1)
         self._keys.add(name)
         patt = match.group(2) or self.default_pattern
-        form = match.group(3) or self.default_format
+        form = match.group(3)
+        converter = self.converters.get(patt)
+        if converter is not None:
+            # An explicit format is handed the native value; otherwise the
+            # converter formats it for us.
+            self._converters.append((name, converter, bool(form)))
+            patt = converter.pattern
+        form = form or self.default_format
         hash = 'x%s' % hashlib.md5(name).hexdigest()
         self._segments[hash] = (name, patt, form)
         return hash
@@ -61,12 +179,45 @@ class Pattern(core.PatternInterface):
             return
         return m.groupdict(), path[m.end():]
 
+    def _convert(self, data):
+        for name, converter, _ in self._converters:
+            try:
+                data[name] = converter.parse(data[name])
+            except ValueError:
+                return
+        return data
+
     def identifiable(self):
         return bool(self.constants or self._keys)
+    
+    def required_keys(self):
+        return self._keys.difference(self.defaults, self.constants)
         
     def _format(self, data):
+        if self._converters:
+            formatted = data.copy()
+            for name, converter, explicit in self._converters:
+                if name not in data:
+                    continue
+                # Parse any strings we were handed so that the re-match check
+                # in `format` compares native values to native values.
+                value = data[name]
+                if isinstance(value, basestring):
+                    try:
+                        value = data[name] = converter.parse(value)
+                    except ValueError as e:
+                        raise core.FormatMatchError(*e.args)
+                if explicit:
+                    formatted[name] = value
+                    continue
+                try:
+                    formatted[name] = converter.format(value)
+                except (TypeError, ValueError) as e:
+                    raise core.FormatMatchError(*e.args)
+        else:
+            formatted = data
         try:
-            return self._format_string % data
+            return self._format_string % formatted
         except KeyError as e:
             raise core.FormatKeyError(*e.args)
 
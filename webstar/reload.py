@@ -0,0 +1,137 @@
+"""Incremental reloading of modules registered via `Router.register_module`
+(and so `register_package`).
+
+    >>> reloader = Reloader(root)
+    >>> reloader.start() # Or call `reloader.check()` yourself.
+
+When the file behind a registered module changes, only that module is
+re-imported, and only its router is rebuilt from the new `__route_args__` and
+`__app__`; the new router is swapped into its parent in place. The cost of a
+reload depends upon the size of the module, not of the app.
+
+Swapping in the new router changes the `graph_generation` of its parent and
+of every router above it. A `SharedRouteCache` only recomputes the signatures
+of those routers, and only drops records which pass through or after the
+reloaded module. The canonical verdicts cached by `RouterInterface` (see
+`canonicalize`) are not scoped like that: generating a URL may try any part of
+the graph, so the root drops all of its verdicts, and rebuilds them as paths
+are requested again.
+
+"""
+
+import logging
+import os
+import threading
+import time
+
+from . import core
+
+
+log = logging.getLogger(__name__)
+
+
+def _source_path(module):
+    path = getattr(module, '__file__', None)
+    if path and path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    return path
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+
+
+class Reloader(object):
+
+    """Watches the modules registered anywhere under a router.
+
+    Params:
+        root -- The router to search for module routers.
+        caches -- Objects with an `invalidate(obj)` method (eg. a
+            `RouteAttrResolver`) which are told about replaced routers and
+            reloaded modules.
+
+    """
+
+    def __init__(self, root, caches=()):
+        self.root = root
+        self.caches = list(caches)
+        self._watched = {}
+        self._thread = None
+        self.rescan()
+
+    def rescan(self):
+        """Find all module routers in the graph; call this if you register
+        more modules after creating the reloader.
+
+        """
+        watched = {}
+        visited = set()
+        def walk(node):
+            if id(node) in visited:
+                return
+            visited.add(id(node))
+            for _, _, child in node.children():
+                if not isinstance(child, core.RouterInterface):
+                    continue
+                module = getattr(child, '_module', None)
+                if module is not None:
+                    path = _source_path(module)
+                    watched[id(child)] = (node, child, path, _mtime(path))
+                walk(child)
+        walk(self.root)
+        self._watched = watched
+
+    def check(self):
+        """Reload any modules whose files have changed; returns the list of
+        reloaded modules.
+
+        """
+        reloaded = []
+        for key, (parent, child, path, mtime) in self._watched.items():
+            new_mtime = _mtime(path)
+            if new_mtime == mtime:
+                continue
+            try:
+                new = self.reload(parent, child)
+            except Exception:
+                log.exception('could not reload %r' % child._module.__name__)
+                # Don't try again until it changes again.
+                self._watched[key] = (parent, child, path, new_mtime)
+                continue
+            del self._watched[key]
+            self._watched[id(new)] = (parent, new, path, new_mtime)
+            reloaded.append(new._module)
+        return reloaded
+
+    def reload(self, parent, child):
+        """Reload the module behind `child`, and replace it in `parent`.
+
+        Returns the new router.
+
+        """
+        module = reload(child._module)
+        log.info('reloaded %r' % module.__name__)
+        new = child.__class__()
+        new._register_module_routes(module, **child._module_kwargs)
+        parent.replace(child, new)
+        module.__router__ = new
+        for cache in self.caches:
+            cache.invalidate(child)
+            cache.invalidate(module)
+        return new
+
+    def start(self, interval=1.0):
+        """Check for changes every `interval` seconds in a daemon thread."""
+        if self._thread is not None:
+            return
+        def target():
+            while True:
+                time.sleep(interval)
+                self.check()
+        self._thread = threading.Thread(target=target, name='webstar.reload')
+        self._thread.daemon = True
+        self._thread.start()
@@ -0,0 +1,246 @@
+"""Replay PATH_INFOs from an access log through a router, and report how
+routing performs on production-shaped input.
+
+    python -m webstar.replay myapp.routes:root access.log
+    python -m webstar.replay myapp.routes:root paths.txt --wsgi --threads 8
+
+Log lines may be bare paths, or anything containing a quoted request line (eg.
+the common/combined log formats). Query strings are dropped.
+
+Leaf apps are never called; `wsgi_route` only returns them, so the timings are
+of routing alone.
+
+"""
+
+import heapq
+import logging
+import multiprocessing
+import optparse
+import re
+import threading
+import time
+
+from . import core
+
+
+log = logging.getLogger(__name__)
+
+
+_request_line_re = re.compile(r'"[A-Z]+ (\S+)(?: HTTP/[\d.]+)?"')
+
+
+def load_router(spec):
+    """Import a router from a "package.module:attribute" spec."""
+    if ':' in spec:
+        module_name, attr = spec.split(':', 1)
+    else:
+        module_name, attr = spec.rsplit('.', 1)
+    module = __import__(module_name, fromlist=['hack'])
+    return getattr(module, attr)
+
+
+def read_paths(lines):
+    """Yield the path of every log line that has one."""
+    for line in lines:
+        m = _request_line_re.search(line)
+        if m:
+            path = m.group(1)
+        else:
+            path = line.strip()
+        if not path.startswith('/'):
+            continue
+        yield path.split('?', 1)[0]
+
+
+def count_backtracks(router, path):
+    """Return the number of dead ends a search must back out of to route the
+    given path.
+
+    """
+    count = [0]
+    def walk(node, path):
+        if not isinstance(node, core.RouterInterface):
+            return True
+        for step in node.route_step(path):
+            if walk(step.head, step.unrouted):
+                return True
+            count[0] += 1
+    walk(router, core.normalize_path(path))
+    return count[0]
+
+
+class ReplayStats(object):
+
+    """The results of a replay.
+
+    Attributes:
+        latencies -- A list of every request's time, in seconds.
+        not_found -- The number of requests which did not route.
+        slowest -- A list of (latency, path) for the slowest paths.
+        elapsed -- The wall time of the whole replay.
+
+    """
+
+    def __init__(self, num_slowest=10):
+        self.num_slowest = num_slowest
+        self.latencies = []
+        self.not_found = 0
+        self.slowest = []
+        self.elapsed = 0.0
+
+    def add(self, path, latency, found):
+        self.latencies.append(latency)
+        if not found:
+            self.not_found += 1
+        self.add_slow(latency, path)
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.not_found += other.not_found
+        for latency, path in other.slowest:
+            self.add_slow(latency, path)
+
+    def add_slow(self, latency, path):
+        if len(self.slowest) < self.num_slowest:
+            heapq.heappush(self.slowest, (latency, path))
+        elif latency > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (latency, path))
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+        return ordered[index]
+
+    def format(self, router=None):
+        lines = []
+        count = self.count
+        lines.append('%d requests in %.3fs: %.0f/s' % (count, self.elapsed,
+            count / self.elapsed if self.elapsed else 0))
+        lines.append('404s: %d (%.2f%%)' % (self.not_found,
+            100.0 * self.not_found / count if count else 0))
+        lines.append('latency (us): p50 %.1f, p90 %.1f, p99 %.1f, p99.9 %.1f, max %.1f' % tuple(
+            1e6 * self.percentile(x) for x in (50, 90, 99, 99.9, 100)))
+        if self.slowest:
+            lines.append('slowest:')
+            seen = set()
+            for latency, path in sorted(self.slowest, reverse=True):
+                if path in seen:
+                    continue
+                seen.add(path)
+                backtracks = ('%6d backtracks' % count_backtracks(router, path)) if router is not None else ''
+                lines.append('  %10.1fus %s %s' % (1e6 * latency, backtracks, path))
+        return '\n'.join(lines)
+
+
+def _replay_serial(router, paths, wsgi, stats):
+    for path in paths:
+        if wsgi:
+            environ = {'PATH_INFO': path, 'SCRIPT_NAME': '', 'REQUEST_METHOD': 'GET'}
+            start = time.time()
+            app = router.wsgi_route(environ)
+            latency = time.time() - start
+            found = app != router.not_found_app
+        else:
+            start = time.time()
+            route = router.route(path)
+            latency = time.time() - start
+            found = route is not None
+        stats.add(path, latency, found)
+    return stats
+
+
+def replay(router, paths, wsgi=False, threads=1, num_slowest=10):
+    """Replay paths through the router, returning a ReplayStats.
+
+    Params:
+        router -- The router to replay through.
+        paths -- A list of paths.
+        wsgi -- Replay through `wsgi_route`, instead of just `route`.
+        threads -- The number of threads to split the paths between.
+
+    """
+    stats = ReplayStats(num_slowest)
+    start = time.time()
+    if threads <= 1:
+        _replay_serial(router, paths, wsgi, stats)
+    else:
+        results = [ReplayStats(num_slowest) for i in xrange(threads)]
+        workers = [threading.Thread(target=_replay_serial,
+            args=(router, paths[i::threads], wsgi, results[i])) for i in xrange(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for result in results:
+            stats.merge(result)
+    stats.elapsed = time.time() - start
+    return stats
+
+
+def _load_only(spec):
+    load_router(spec)
+
+
+def _process_target(args):
+    spec, paths, wsgi, num_slowest = args
+    router = load_router(spec)
+    return _replay_serial(router, paths, wsgi, ReplayStats(num_slowest))
+
+
+def replay_processes(spec, paths, wsgi=False, processes=2, num_slowest=10):
+    """Replay paths through the router loaded (in each process) from `spec`,
+    returning a ReplayStats.
+
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Make sure every process has loaded the router before we start timing.
+        pool.map(_load_only, [spec] * processes)
+        start = time.time()
+        results = pool.map(_process_target, [(spec, paths[i::processes], wsgi, num_slowest)
+            for i in xrange(processes)])
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+    stats = ReplayStats(num_slowest)
+    for result in results:
+        stats.merge(result)
+    stats.elapsed = elapsed
+    return stats
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] package.module:router LOGFILE')
+    parser.add_option('-w', '--wsgi', action='store_true',
+        help='replay through wsgi_route instead of route')
+    parser.add_option('-t', '--threads', type='int', default=1)
+    parser.add_option('-p', '--processes', type='int', default=0)
+    parser.add_option('-r', '--repeat', type='int', default=1,
+        help='replay the log this many times')
+    parser.add_option('-s', '--slowest', type='int', default=10,
+        help='number of slowest paths to report')
+    opts, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.error('requires a router and a log file')
+    spec, log_path = args
+
+    with open(log_path) as fh:
+        paths = list(read_paths(fh)) * opts.repeat
+
+    router = load_router(spec)
+    if opts.processes:
+        stats = replay_processes(spec, paths, opts.wsgi, opts.processes, opts.slowest)
+    else:
+        stats = replay(router, paths, opts.wsgi, opts.threads, opts.slowest)
+    print stats.format(router)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,19 @@
 from bisect import insort
 import collections
+import contextlib
 import functools
 import hashlib
+import heapq
+import itertools
 import logging
-import os
 import posixpath
 import re
 import sys
+import threading
 
+from . import codegen
 from . import core
+from . import discovery
 from . import pattern as patmod
 
 
@@ -19,21 +24,177 @@ log = logging.getLogger(__name__)
 def route(pattern, func=None, **kwargs):
     if func is None:
         return functools.partial(route, pattern, **kwargs)
-    route._counter += 1
-    func.__dict__.setdefault('__route_args__', []).append((route._counter, pattern, func, kwargs))
+    func.__dict__.setdefault('__route_args__', []).append((next(route._counter), pattern, func, kwargs))
     return func
 
-route._counter = 0
+# Orders routes by their definition; `next` on a count is atomic, so modules
+# may be imported by several threads at once.
+route._counter = itertools.count(1)
+
+
+_literal_regex_re = re.compile(r'^[A-Za-z0-9_]+$')
+
+
+def _literal_path(pattern):
+    """Return the one path prefix that a Pattern can match (eg. the
+    "/{pkg:name}" patterns of `register_package`), or None if there is not
+    exactly one.
+    
+    """
+    if type(pattern) is not patmod.Pattern:
+        return
+    # Patterns don't change, but batches rebuild the dispatch of the table.
+    try:
+        return pattern._literal_path
+    except AttributeError:
+        pass
+    literal = pattern._literal_path = _find_literal_path(pattern)
+    return literal
+
+
+def _find_literal_path(pattern):
+    raw = pattern._raw
+    if '{' in raw:
+        for m in pattern.token_re.finditer(raw):
+            regex = m.group(2)
+            if not regex or regex in pattern.converters or not _literal_regex_re.match(regex):
+                return
+        literal = pattern.token_re.sub(lambda m: m.group(2), raw)
+    else:
+        literal = raw
+    if literal.startswith('/') and '' not in literal[1:].split('/'):
+        return literal
+
+
+def _build_dispatch(apps):
+    """Return (literals, depths, others) for dispatching on the leading
+    segments of paths.
+    
+    `literals` maps the literal path prefix of a pattern (see
+    `_literal_path`) to the entries of the table with it, in order. `depths`
+    are the numbers of segments which those prefixes have, and `others` are
+    the entries which must always be tried; they are held once, and merged
+    with the matching literals' entries for each path.
+    
+    """
+    literals = {}
+    others = []
+    for entry in apps:
+        literal = _literal_path(entry[1])
+        if literal is None:
+            others.append(entry)
+        else:
+            # Almost always the only pattern with its literal.
+            existing = literals.get(literal)
+            literals[literal] = (entry, ) if existing is None else existing + (entry, )
+    depths = tuple(sorted(set(literal.count('/') for literal in literals)))
+    return literals, depths, tuple(others)
+
+
+def _extend_dispatch(dispatch, entry):
+    """Return a copy of a dispatch (see `_build_dispatch`) with one more entry
+    of the table; cheaper than building it again.
+    
+    """
+    literals, depths, others = dispatch
+    literal = _literal_path(entry[1])
+    if literal is None:
+        others = list(others)
+        insort(others, entry)
+        return literals, depths, tuple(others)
+    literals = dict(literals)
+    entries = list(literals.get(literal, ()))
+    insort(entries, entry)
+    literals[literal] = tuple(entries)
+    depth = literal.count('/')
+    if depth not in depths:
+        depths = tuple(sorted(depths + (depth, )))
+    return literals, depths, others
 
 
 class Router(core.RouterInterface):
+    
+    """A router which matches paths against a list of patterns.
+    
+    The table of patterns is never mutated in place; registering builds a new
+    table and publishes it with a single reference swap, so routing threads
+    never need to take a lock (or see a half-built table), and routes may be
+    registered while the router is live.
+    
+    Within `batch` (or `register_many`) registrations are gathered up, then
+    sorted and published once when it ends, so building a large table costs
+    one sort instead of a copy and insort per route.
+    
+    """
+
+    # Set by `register_module` on the router it creates.
+    _module = None
+    _module_kwargs = None
+    
+    # (apps, route_step) generated for a table; see `compile`.
+    _matcher = None
+    
+    # With at least this many patterns that can only match one literal path
+    # prefix (like those from `register_package`), `route_step` looks up the
+    # leading segments of the path in a dict to find the patterns to try,
+    # instead of trying every one in turn.
+    _dispatch_threshold = 8
+    # (apps, dispatch) for the current table; published along with it, with
+    # a dispatch of None if under the threshold.
+    _dispatch = ((), None)
+    # The dispatch for the current table, even if under the threshold; only
+    # for writers, to extend.
+    _index = ({}, (), ())
 
     def __init__(self):
         super(Router, self).__init__()
-        self._apps = []
+        self._apps = ()
+        # Only writers take the lock, to serialize concurrent registrations.
+        # It is held for the duration of a batch, and so is reentrant.
+        self._write_lock = threading.RLock()
+        # The registrations gathered during a batch; None outside of one.
+        self._pending = None
+    
+    def _publish(self, apps, added, index=None):
+        """Publish a new table; `apps` must be sorted and is not copied,
+        `added` are the nodes which are new to it, and `index` is its
+        dispatch if the caller has already built it.
+        
+        """
+        for node in added:
+            if isinstance(node, core.RouterInterface):
+                node._add_parent(self)
+        apps = tuple(apps)
+        if index is None:
+            index = _build_dispatch(apps)
+        self._index = index
+        # Readers take the table from here, so that they never see a
+        # dispatch built for another one.
+        self._dispatch = (apps, self._active_dispatch(apps, index))
+        self._apps = apps
+        self._matcher = None
+        self._graph_changed()
+    
+    @property
+    def dispatch_threshold(self):
+        return self._dispatch_threshold
+    
+    @dispatch_threshold.setter
+    def dispatch_threshold(self, value):
+        with self._write_lock:
+            self._dispatch_threshold = value
+            apps = self._apps
+            self._dispatch = (apps, self._active_dispatch(apps, self._index))
+    
+    def _active_dispatch(self, apps, index):
+        if len(apps) - len(index[2]) >= self._dispatch_threshold:
+            return index
         
     def children(self):
         return [(pattern.identifiable(), pattern._raw, node) for _, pattern, node in self._apps]
+    
+    def generate_children(self):
+        return [(pattern, node) for _, pattern, node in self._apps]
         
     def register(self, pattern, app=None, **kwargs):
         """Register directly, or use as a decorator.
@@ -47,14 +208,25 @@ class Router(core.RouterInterface):
 
         # We are being used directly here.
         if app:
+            if isinstance(app, core.RouterInterface) and app._reaches(self):
+                raise core.GraphCycleError('registering %r on %r would create a cycle' % (app, self))
+            
             # We are creating a key here that will first respect the requested
             # priority of apps relative to each other, but in the case of
             # multiple apps at the same priority, respect the registration
             # order.
             
-            priority = (-kwargs.pop('_priority', 0), len(self._apps))
+            priority = -kwargs.pop('_priority', 0)
             pattern = patmod.Pattern(pattern, **kwargs)
-            insort(self._apps, (priority, pattern, app))
+            with self._write_lock:
+                if self._pending is not None:
+                    order = len(self._apps) + len(self._pending)
+                    self._pending.append(((priority, order), pattern, app))
+                else:
+                    apps = list(self._apps)
+                    entry = ((priority, len(apps)), pattern, app)
+                    insort(apps, entry)
+                    self._publish(apps, (app, ), _extend_dispatch(self._index, entry))
             
             # log.debug('register %r -> %r' % (pattern, app))
             
@@ -64,9 +236,51 @@ class Router(core.RouterInterface):
         # work later.
         return functools.partial(self.register, pattern, **kwargs)
 
+    @contextlib.contextmanager
+    def batch(self):
+        """Gather all registrations made within the block, and publish them
+        together at the end of it.
+        
+        Routing threads see none of them until the block ends; if it raises,
+        or they would create a cycle (raising GraphCycleError), none of them
+        are published at all. Other threads' registrations wait
+        for the block to end. Batches may be nested.
+        
+        """
+        with self._write_lock:
+            if self._pending is not None:
+                yield
+                return
+            self._pending = []
+            try:
+                yield
+                pending = self._pending
+            finally:
+                self._pending = None
+            if pending:
+                added = [node for _, _, node in pending]
+                # Routers registered within the block were checked against the
+                # graph as it was then, which did not include their siblings.
+                for node in added:
+                    if isinstance(node, core.RouterInterface) and node._reaches(self):
+                        raise core.GraphCycleError('registering %r on %r would create a cycle' % (node, self))
+                pending.extend(self._apps)
+                pending.sort()
+                self._publish(pending, added)
+    
+    def register_many(self, routes):
+        """Register an iterable of (pattern, app) or (pattern, app, kwargs)
+        tuples in a single batch.
+        
+        """
+        with self.batch():
+            for route in routes:
+                kwargs = route[2] if len(route) > 2 else {}
+                self.register(route[0], route[1], **kwargs)
+    
     def register_package(self, pattern, package,
         recursive=False, testing=False, include_self=False, data_key=None,
-        include_protected=False, **kwargs):
+        include_protected=False, discovery_index=None, **kwargs):
         
         if isinstance(package, basestring):
             package = __import__(package, fromlist=['hack'])
@@ -77,19 +291,7 @@ class Router(core.RouterInterface):
         
         # Look for unloaded modules.
         for directory in package.__path__:
-            if not os.path.exists(directory):
-                continue
-            for name in os.listdir(directory):
-                init_path = os.path.join(directory, name, '__init__.py')
-                if os.path.exists(init_path) or os.path.exists(init_path + 'c'):
-                    module_names.add(name)
-                    continue
-                if not (name.endswith('.py') or name.endswith('.pyc')):
-                    continue
-                name = name.rsplit('.', 1)[0]
-                if name == '__init__':
-                    continue
-                module_names.add(name)
+            module_names.update(discovery.find_module_names(directory, discovery_index))
         
         # Look for already imported modules; essentially for testing.
         if testing:
@@ -99,37 +301,41 @@ class Router(core.RouterInterface):
                 if name.startswith(package.__name__ + '.'):
                     module_names.add(name[len(package.__name__)+1:].split('.', 1)[0])
         
-        for name in sorted(module_names):
-            if name.startswith('_') and not include_protected:
-                continue
-            try:
-                module_name = package.__name__ + '.' + name
-                module = __import__(module_name, fromlist=['hack'])
-            except ImportError as e:
-                if e.args[0].endswith(' ' + module_name):
-                    log.warn('could not import %r; skipping' % (package.__name__ + '.' + name))
-                else:
-                    raise
-            else:
-                subpattern = core.normalize_path(pattern, '{%s:%s}' % (data_key, name))
-                if recursive and (
-                    hasattr(module, '__path__') or
-                    module.__file__.endswith('/__import__.py') or
-                    module.__file__.endswith('/__import__.pyc')
-                ):
-                    self.register_package(subpattern, module,
-                        recursive=recursive,
-                        include_self=include_self,
-                        testing=testing,
-                        data_key=name + '_' + data_key,
-                        include_protected=include_protected,
-                        **kwargs
-                    )
+        # Register everything at once, instead of re-sorting the table for
+        # every module.
+        with self.batch():
+            for name in sorted(module_names):
+                if name.startswith('_') and not include_protected:
+                    continue
+                try:
+                    module_name = package.__name__ + '.' + name
+                    module = __import__(module_name, fromlist=['hack'])
+                except ImportError as e:
+                    if e.args[0].endswith(' ' + module_name):
+                        log.warn('could not import %r; skipping' % (package.__name__ + '.' + name))
+                    else:
+                        raise
                 else:
-                    self.register_module(subpattern, module, **kwargs)
+                    subpattern = core.normalize_path(pattern, '{%s:%s}' % (data_key, name))
+                    if recursive and (
+                        hasattr(module, '__path__') or
+                        module.__file__.endswith('/__import__.py') or
+                        module.__file__.endswith('/__import__.pyc')
+                    ):
+                        self.register_package(subpattern, module,
+                            recursive=recursive,
+                            include_self=include_self,
+                            testing=testing,
+                            data_key=name + '_' + data_key,
+                            include_protected=include_protected,
+                            discovery_index=discovery_index,
+                            **kwargs
+                        )
+                    else:
+                        self.register_module(subpattern, module, **kwargs)
         
-        if include_self:
-            self.register_module(pattern, package, **kwargs)
+            if include_self:
+                self.register_module(pattern, package, **kwargs)
     
     def register_module(self, pattern, module, **kwargs):
         if isinstance(module, str):
@@ -139,6 +345,17 @@ class Router(core.RouterInterface):
 
         router = module.__router__ = self.__class__()
         self.register(pattern, router, defaults=dict(__module__=module))
+        router._register_module_routes(module, **kwargs)
+    
+    def _register_module_routes(self, module, **kwargs):
+        """Register everything tagged by `route` in the module, and its
+        `__app__` as a fallback.
+        
+        """
+        
+        # Remember where we came from so `webstar.reload` can rebuild us.
+        self._module = module
+        self._module_kwargs = kwargs
         
         args = []
         for func in module.__dict__.itervalues():
@@ -146,29 +363,127 @@ class Router(core.RouterInterface):
                 continue
             args.extend(func.__route_args__)
         args.sort()
-        for arg_set in args:
-            try:
-                _, sub_pattern, func, sub_kwargs = arg_set
-            except TypeError:
-                continue
-            router.register(sub_pattern, func, **sub_kwargs)
-            
-        default = getattr(module, '__app__', None)
-        if default:
-            router.register(None, default, **kwargs)
+        with self.batch():
+            for arg_set in args:
+                try:
+                    _, sub_pattern, func, sub_kwargs = arg_set
+                except TypeError:
+                    continue
+                self.register(sub_pattern, func, **sub_kwargs)
+                
+            default = getattr(module, '__app__', None)
+            if default:
+                self.register(None, default, **kwargs)
+    
+    def compile(self, recursive=True):
+        """Generate a `route_step` specialized to the current table (and that
+        of every Router below this one, if recursive); see `webstar.codegen`.
+        
+        Registering on the router afterwards reverts it to the interpreted
+        search, until it is compiled again.
+        
+        """
+        visited = set()
+        def walk(router):
+            if id(router) in visited:
+                return
+            visited.add(id(router))
+            # Other routers may publish concurrently (we only hold our own
+            # lock), so the matcher is tied to the table it was built for;
+            # `route_step` checks it against the one it takes from here.
+            apps = router._dispatch[0]
+            router._matcher = (apps, codegen.compile_router(router, apps))
+            if recursive:
+                for _, _, node in apps:
+                    if isinstance(node, Router):
+                        walk(node)
+        with self._write_lock:
+            walk(self)
+    
+    def replace(self, old, new):
+        """Swap a child node for another, keeping its pattern and priority."""
+        if isinstance(new, core.RouterInterface) and new._reaches(self):
+            raise core.GraphCycleError('replacing with %r on %r would create a cycle' % (new, self))
+        swap = lambda apps: [(key, pattern, new if node is old else node)
+            for key, pattern, node in apps]
+        with self._write_lock:
+            published = any(node is old for _, _, node in self._apps)
+            pending = self._pending or ()
+            if not published and not any(node is old for _, _, node in pending):
+                raise ValueError('%r is not a child of %r' % (old, self))
+            if pending:
+                self._pending[:] = swap(pending)
+            if published:
+                self._publish(swap(self._apps), (new, ))
+    
+    def _make_step(self, path, pattern, node, m):
+        data, unrouted = m
+        return core.RouteStep(
+            head=node,
+            router=self,
+            consumed=path[:-len(unrouted)] if unrouted else path,
+            unrouted=core.normalize_path(unrouted),
+            data=data,
+            pattern=pattern,
+        )
     
     def route_step(self, path):
-        for _, pattern, node in self._apps:
+        apps, dispatch = self._dispatch
+        matcher = self._matcher
+        if matcher is not None and matcher[0] is apps:
+            return matcher[1](path)
+        if dispatch is None:
+            return self._scan_route_step(path, apps)
+        return self._dispatch_route_step(path, dispatch)
+    
+    def _dispatch_route_step(self, path, dispatch):
+        literals, depths, others = dispatch
+        found = []
+        for depth in depths:
+            parts = path.split('/', depth + 1)
+            if len(parts) <= depth:
+                break
+            prefix = '/'.join(parts[:depth + 1])
+            # The patterns also match before a trailing newline (via `$`).
+            if prefix.endswith('\n'):
+                prefix = prefix[:-1]
+            matched = literals.get(prefix)
+            if matched is not None:
+                found.append(matched)
+        # Each entry is under at most one literal, so these never overlap.
+        if not found:
+            entries = others
+        elif len(found) == 1 and not others:
+            entries = found[0]
+        else:
+            entries = heapq.merge(others, *found)
+        for _, pattern, node in entries:
             m = pattern.match(path)
             if m:
-                data, unrouted = m
-                yield core.RouteStep(
-                    head=node,
-                    router=self,
-                    consumed=path[:-len(unrouted)] if unrouted else path,
-                    unrouted=core.normalize_path(unrouted),
-                    data=data
-                )
+                yield self._make_step(path, pattern, node, m)
+    
+    def _scan_route_step(self, path, apps):
+        for _, pattern, node in apps:
+            m = pattern.match(path)
+            if m:
+                yield self._make_step(path, pattern, node, m)
+    
+    def reference_route_step(self, path):
+        return self._scan_route_step(path, self._apps)
+    
+    def step_index(self, step):
+        for i, (_, pattern, _) in enumerate(self._apps):
+            if pattern is step.pattern:
+                return i
+    
+    def route_step_at(self, path, index):
+        try:
+            _, pattern, node = self._apps[index]
+        except IndexError:
+            return
+        m = pattern.match(path)
+        if m:
+            return self._make_step(path, pattern, node, m)
 
     def generate_step(self, data):
         for _, pattern, node in self._apps:
@@ -183,7 +498,7 @@ class Router(core.RouterInterface):
                     head=node,
                     identifiable=pattern.identifiable(),
                 )
-
-
-
-
+    
+    # The plain linear search; any faster one must agree with it (see
+    # `webstar.shadow`).
+    reference_generate_step = generate_step
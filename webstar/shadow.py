@@ -0,0 +1,153 @@
+"""Shadow mode; checks a sample of live routing and URL generation against the
+plain reference algorithms, so that optimized ones (route caches, indexed
+dispatch, compiled matchers, etc.) can be proven in production.
+
+    >>> root.shadow = Shadow(sample_rate=0.001)
+
+Sampled calls to `route` (and so `wsgi_route`) and `generate` (and so
+`url_for`) are repeated via `reference_route` and `reference_generate`, which
+search with `RouterInterface.reference_route_step` and
+`reference_generate_step` and with no caching or memoization at all. Any
+difference is logged and counted, along with the input that reproduces it.
+
+The cost of a call which is not sampled is one call to `random`.
+
+"""
+
+import collections
+import logging
+import random
+
+from . import core
+from .counters import ThreadCounter, counter_property
+
+
+log = logging.getLogger(__name__)
+
+
+Mismatch = collections.namedtuple('Mismatch', 'kind router input expected actual')
+
+
+def reference_route(router, path):
+    """Return the list of RouteSteps for a (normalized) path, or None."""
+    stack = set()
+    def walk(node, path):
+        if not isinstance(node, core.RouterInterface):
+            return []
+        key = (id(node), path)
+        if key in stack:
+            raise core.GraphCycleError('cycle to %r with %r unrouted' % (node, path))
+        stack.add(key)
+        try:
+            for step in node.reference_route_step(path):
+                res = walk(step.head, step.unrouted)
+                if res is not None:
+                    return [step] + res
+        finally:
+            stack.remove(key)
+    steps = walk(router, path)
+    if steps:
+        core._parse_steps(steps)
+        return steps
+
+
+def reference_generate(router, data):
+    """Return the URL for the given data, or None."""
+    data = data.copy()
+    def walk(node):
+        if not isinstance(node, core.RouterInterface):
+            yield []
+            return
+        steps = list(node.reference_generate_step(data))
+        meta = core.GenerateStepMeta(ambiguous=len(steps) != 1)
+        for step in steps:
+            for sub_steps in walk(step.head):
+                yield [(step, meta)] + sub_steps
+    for steps in walk(router):
+        url = core.join_generated(steps)
+        if url is not None:
+            return url
+
+
+def _summarize(steps):
+    """Return a comparable summary of a list of RouteSteps."""
+    if steps is None:
+        return None
+    return [(step.head, step.consumed, step.unrouted, step.data, step.pattern)
+        for step in steps]
+
+
+def _same_steps(a, b):
+    if a is None or b is None:
+        return a is b
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if not (x.head is y.head and x.pattern is y.pattern and x.consumed == y.consumed
+                and x.unrouted == y.unrouted and x.data == y.data):
+            return False
+    return True
+
+
+class Shadow(object):
+
+    """Compares a sample of results to those of the reference algorithms.
+
+    Params:
+        sample_rate -- The fraction of calls to check.
+        max_mismatches -- The number of recent Mismatches to hold onto.
+        random -- The function to sample with; returns a float in [0, 1).
+
+    Attributes:
+        routes_checked -- The number of routes which have been checked.
+        urls_checked -- The number of URLs which have been checked.
+        mismatch_count -- The number of differences found.
+        mismatches -- The most recent Mismatches.
+
+    """
+
+    def __init__(self, sample_rate=0.01, max_mismatches=100, random=random.random):
+        self.sample_rate = sample_rate
+        self.random = random
+        self._routes_checked = ThreadCounter()
+        self._urls_checked = ThreadCounter()
+        self._mismatch_count = ThreadCounter()
+        self.mismatches = collections.deque(maxlen=max_mismatches)
+
+    routes_checked = counter_property('_routes_checked')
+    urls_checked = counter_property('_urls_checked')
+    mismatch_count = counter_property('_mismatch_count')
+
+    def sample(self):
+        return self.random() < self.sample_rate
+
+    def check_route(self, router, path, route):
+        """Check the result of `router.route(path)`."""
+        self._routes_checked.add()
+        actual = route[1:] if route is not None else None
+        try:
+            expected = reference_route(router, path)
+        except Exception as e:
+            log.exception('shadow reference route failed for %r' % path)
+            self._mismatch('route', router, path, e, _summarize(actual))
+            return
+        if not _same_steps(expected, actual):
+            self._mismatch('route', router, path, _summarize(expected), _summarize(actual))
+
+    def check_url(self, router, data, url):
+        """Check the result of `router.generate(data)`."""
+        self._urls_checked.add()
+        try:
+            expected = reference_generate(router, data)
+        except Exception as e:
+            log.exception('shadow reference generate failed for %r' % data)
+            self._mismatch('url', router, data, e, url)
+            return
+        if expected != url:
+            self._mismatch('url', router, data, expected, url)
+
+    def _mismatch(self, kind, router, input, expected, actual):
+        self._mismatch_count.add()
+        self.mismatches.append(Mismatch(kind, router, input, expected, actual))
+        log.warning('shadow %s mismatch on %r for %r: expected %r, got %r' % (
+            kind, router, input, expected, actual))
@@ -0,0 +1,230 @@
+"""A route cache which can be shared between processes via a memory-mapped
+file, so that pre-forked workers on the same host reuse each other's work.
+
+Usage:
+
+    >>> router.route_cache = SharedRouteCache('/tmp/myapp.routes')
+
+The cache maps normalized paths to the index of the child chosen at every step
+of the route (see `RouterInterface.step_index`). A hit replays those choices
+via `RouterInterface.route_step_at`, which re-matches only the chosen patterns,
+so the route data (and any predicates or parsers) is exactly what a full
+search would have found; we just skip the backtracking.
+
+The file is a flat array of fixed-size slots, addressed directly by a hash of
+the path. There are no locks: every slot carries a checksum, so a reader
+racing with a writer (or two writers racing each other) just sees a miss.
+
+Every record is stamped with a signature of the parts of the routing graph
+it was resolved against: at every step, the patterns of the chosen child and
+of those before it, and the whole subtrees of those before it (any of which
+might now match instead). Workers running the same code agree on the
+signatures, so stale records are never replayed, but a change to one subtree
+(eg. a module reloaded by `webstar.reload`) only invalidates the records which
+pass through or after it. Signatures are kept per router, and only
+recalculated for those whose `graph_generation` has changed; ie. the changed
+router and those above it.
+
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import weakref
+import zlib
+
+from . import core
+from .counters import ThreadCounter, counter_property
+
+
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'WSRC'
+VERSION = 1
+
+_header = struct.Struct('<4sIII') # magic, version, slot_count, slot_size
+_slot_header = struct.Struct('<iH') # crc32, payload length
+_record_header = struct.Struct('<8sHB') # signature, path length, step count
+
+
+class SharedRouteCache(object):
+
+    """Cache of route resolutions in a memory-mapped file.
+
+    Params:
+        path -- The file to map. It is created if it does not exist.
+        slot_count -- The number of records the cache holds.
+        slot_size -- The size of each record; paths which (with their step
+            indices) do not fit are never cached.
+
+    """
+
+    def __init__(self, path, slot_count=65536, slot_size=256):
+        self.path = path
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+
+        self._hits = ThreadCounter()
+        self._misses = ThreadCounter()
+
+        size = _header.size + slot_count * slot_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        header = _header.unpack(self._mmap[:_header.size])
+        if header[0] == '\0' * 4:
+            self._mmap[:_header.size] = _header.pack(MAGIC, VERSION, slot_count, slot_size)
+        elif header != (MAGIC, VERSION, slot_count, slot_size):
+            raise ValueError('%r has incompatible header %r' % (path, header))
+
+        # Router ids to (weakref, graph_generation, signature, prefixes,
+        # children); see `_node_signatures`.
+        self._nodes = {}
+
+    hits = counter_property('_hits')
+    misses = counter_property('_misses')
+    
+    def close(self):
+        self._mmap.close()
+
+    def clear(self):
+        """Empty the cache for every process sharing it."""
+        self._mmap[_header.size:] = '\0' * (self.slot_count * self.slot_size)
+
+    def _node_signatures(self, node, stack=()):
+        """Return (signature, prefixes, children) for a router.
+        
+        The signature covers its whole subtree, and depends only upon the
+        patterns and the shape of the graph, so that separate processes which
+        build the same graph agree upon it. `prefixes[i]` covers everything at
+        this level that a route through child `i` depends upon: the patterns
+        up to and including its own, and the subtrees of those before it.
+        
+        """
+        key = id(node)
+        cached = self._nodes.get(key)
+        if cached is not None and cached[0]() is node and cached[1] == node.graph_generation:
+            return cached[2:]
+        if key in stack:
+            raise core.GraphCycleError('cycle to %r' % node)
+        # Taken first, so that a change while we walk leaves us stale.
+        generation = node.graph_generation
+        hasher = hashlib.md5('node:%s;' % node.__class__.__name__)
+        prefixes = []
+        children = []
+        for identifiable, pattern, child in node.children():
+            is_router = isinstance(child, core.RouterInterface)
+            entry = 'child:%d:%r:%s;' % (bool(identifiable), pattern,
+                'router' if is_router else 'leaf')
+            prefix = hasher.copy()
+            prefix.update(entry)
+            prefixes.append(prefix.digest()[:8])
+            children.append(child)
+            hasher.update(entry)
+            if is_router:
+                hasher.update(self._node_signatures(child, stack + (key, ))[0])
+        signature = hasher.digest()[:8]
+        nodes = self._nodes
+        ref = weakref.ref(node, lambda ref: nodes.pop(key, None))
+        nodes[key] = (ref, generation, signature, prefixes, children)
+        return signature, prefixes, children
+
+    def _signature(self, root, indices):
+        """Return the signature of a route from the root via the given child
+        indices, or None if they do not lead to a leaf."""
+        hasher = hashlib.md5()
+        node = root
+        for index in indices:
+            if not isinstance(node, core.RouterInterface):
+                return
+            _, prefixes, children = self._node_signatures(node)
+            if index >= len(prefixes):
+                return
+            hasher.update(prefixes[index])
+            node = children[index]
+        if not isinstance(node, core.RouterInterface):
+            return hasher.digest()[:8]
+
+    def _key(self, path):
+        return path.encode('utf8') if isinstance(path, unicode) else path
+
+    def _offset(self, path):
+        slot = (zlib.crc32(path) & 0xffffffff) % self.slot_count
+        return _header.size + slot * self.slot_size
+
+    def _read(self, path):
+        path = self._key(path)
+        offset = self._offset(path)
+        raw = self._mmap[offset:offset + self.slot_size]
+        crc, length = _slot_header.unpack_from(raw)
+        if not length or length > self.slot_size - _slot_header.size:
+            return
+        payload = raw[_slot_header.size:_slot_header.size + length]
+        if zlib.crc32(payload) != crc:
+            return
+        signature, path_length, count = _record_header.unpack_from(payload)
+        start = _record_header.size
+        if payload[start:start + path_length] != path:
+            return
+        start += path_length
+        indices = struct.unpack_from('<%dH' % count, payload, start)
+        return signature, indices
+
+    def get(self, root, path):
+        """Return the list of RouteSteps for the given path, or None."""
+        record = self._read(path)
+        if record is None or record[0] != self._signature(root, record[1]):
+            self._misses.add()
+            return
+        steps = []
+        node = root
+        unrouted = path
+        for index in record[1]:
+            if not isinstance(node, core.RouterInterface):
+                break
+            step = node.route_step_at(unrouted, index)
+            if step is None:
+                break
+            steps.append(step)
+            node = step.head
+            unrouted = step.unrouted
+        else:
+            if not isinstance(node, core.RouterInterface):
+                self._hits.add()
+                return steps
+        log.warning('could not replay cached route %r for %r' % (record[1], path))
+        self._misses.add()
+
+    def set(self, root, path, steps):
+        """Record the steps which resolved the given path."""
+        indices = []
+        for step in steps:
+            index = step.router.step_index(step) if step.router is not None else None
+            if index is None or index > 0xffff:
+                return
+            indices.append(index)
+        path = self._key(path)
+        if len(indices) > 0xff or len(path) > self.slot_size:
+            return
+        signature = self._signature(root, indices)
+        if signature is None:
+            # The graph changed under us.
+            return
+        payload = (
+            _record_header.pack(signature, len(path), len(indices)) +
+            path +
+            struct.pack('<%dH' % len(indices), *indices)
+        )
+        if _slot_header.size + len(payload) > self.slot_size:
+            return
+        slot = _slot_header.pack(zlib.crc32(payload), len(payload)) + payload
+        offset = self._offset(path)
+        self._mmap[offset:offset + len(slot)] = slot